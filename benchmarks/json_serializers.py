@@ -0,0 +1,77 @@
+"""
+Compares encoding responses with ``jsonify`` against the serializers in
+:mod:`twopi_flask_utils.restful.serializers`, over a few representative
+payloads: a page of paginated items, a large list, and a validation error.
+
+``orjson`` is skipped if it isn't installed.
+
+Run with ``python benchmarks/json_serializers.py``.
+"""
+import datetime
+import decimal
+import timeit
+import uuid
+from flask import Flask, jsonify
+from twopi_flask_utils.restful.serializers import (
+    StdlibSerializer, OrjsonSerializer, orjson)
+
+app = Flask(__name__)
+
+
+def make_item(i):
+    return {
+        'id': str(uuid.UUID(int=i)),
+        'name': 'Item {}'.format(i),
+        'description': 'A reasonably long description of item {}.'.format(i) * 3,
+        'createdAt': '2016-02-01T10:{:02d}:00+00:00'.format(i % 60),
+        'price': i * 1.25,
+        'tags': ['one', 'two', 'three'],
+        'active': i % 2 == 0,
+        'owner': {'id': i % 17, 'name': 'Owner {}'.format(i % 17)},
+    }
+
+
+def make_native_item(i):
+    # The same item, before it has been dumped by a marshmallow schema.
+    item = make_item(i)
+    item['id'] = uuid.UUID(int=i)
+    item['createdAt'] = datetime.datetime(2016, 2, 1, 10, i % 60)
+    item['price'] = decimal.Decimal(i) * decimal.Decimal('1.25')
+    return item
+
+
+PAYLOADS = [
+    ('page of 20', {'offset': 0, 'limit': 20, 'totalItems': 1000,
+                    'items': [make_item(i) for i in range(20)]}, 5000),
+    ('list of 5000', {'items': [make_item(i) for i in range(5000)]}, 20),
+    ('native 5000', {'items': [make_native_item(i) for i in range(5000)]}, 20),
+    ('error', {'_errors': ['Resource expected a JSON payload to be provided.']},
+     20000),
+]
+
+
+def main():
+    serializers = [('jsonify', lambda data: jsonify(data)),
+                   ('stdlib', StdlibSerializer().response)]
+    if orjson is not None:
+        serializers.append(('orjson', OrjsonSerializer().response))
+
+    for debug in (False, True):
+        app.debug = debug
+        with app.test_request_context():
+            for name, data, number in PAYLOADS:
+                for label, serialize in serializers:
+                    if name.startswith('native') and label != 'orjson':
+                        # Neither the stdlib nor Flask's encoder handle
+                        # Decimal.
+                        continue
+
+                    best = min(timeit.repeat(lambda: serialize(data),
+                                             number=number, repeat=5))
+                    print('{:<6} {:<13} {:<8} {:10.1f} us/response'.format(
+                        'debug' if debug else '', name, label,
+                        best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Measures the per-request overhead of dumping a page with :func:`paginated`'s
+envelope schema, comparing a schema class built on every call to the
+memoized :func:`twopi_flask_utils.pagination.pagination_schema`.
+
+Run with ``python benchmarks/pagination_schema.py``.
+"""
+import timeit
+from marshmallow import Schema, fields
+from twopi_flask_utils.pagination import pagination_schema
+
+
+class ItemSchema(Schema):
+    id = fields.Integer()
+    name = fields.String()
+
+
+PAGE = {
+    'offset': 0,
+    'limit': 20,
+    'totalItems': 1000,
+    'items': [{'id': i, 'name': 'item {}'.format(i)} for i in range(20)],
+}
+
+
+def rebuilt():
+    class _Pagination(Schema):
+        offset = fields.Integer()
+        limit = fields.Integer()
+        totalItems = fields.Integer()
+        items = fields.Nested(ItemSchema, many=True)
+
+    return _Pagination().dump(PAGE)
+
+
+def memoized():
+    return pagination_schema(ItemSchema).dump(PAGE)
+
+
+def main(number=2000):
+    for name, func in [('rebuilt per call', rebuilt), ('memoized', memoized)]:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<20} {:8.1f} us/page'.format(name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
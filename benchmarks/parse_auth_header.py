@@ -0,0 +1,69 @@
+"""
+Measures the per-request overhead of extracting the token in
+:func:`~twopi_flask_utils.token_auth.parse_auth_header`, comparing the
+previous extraction (always parsing the query string, then matching the
+``Authorization`` header with a regex) with the token source pipeline.
+
+The cost of pushing a request context is measured separately and
+subtracted.
+
+Run with ``python benchmarks/parse_auth_header.py``.
+"""
+import re
+import timeit
+from flask import Flask, request
+from werkzeug.test import EnvironBuilder
+from twopi_flask_utils.token_auth.decorators import (
+    default_token_sources, extract_raw_token)
+
+app = Flask(__name__)
+bearer_re = re.compile(r'Bearer (.+)')
+sources = default_token_sources()
+
+
+def legacy_extract():
+    raw_token = None
+    if 'token' in request.args:
+        raw_token = request.args['token']
+
+    if 'Authorization' in request.headers:
+        token_res = bearer_re.match(request.headers['Authorization'])
+        if token_res is not None:
+            raw_token = token_res.group(1)
+    return raw_token
+
+
+def pipeline_extract():
+    return extract_raw_token(sources)
+
+
+def per_request(environ, extract):
+    def run():
+        with app.request_context(environ):
+            extract()
+    return run
+
+
+def main(number=20000):
+    environs = [
+        ('header', EnvironBuilder(
+            path='/items', query_string='offset=20&limit=20&sort=name',
+            headers={'Authorization': 'Bearer abc.def.ghi'}).get_environ()),
+        ('query string', EnvironBuilder(
+            path='/items', query_string='offset=20&limit=20&token=abc.def.ghi'
+        ).get_environ()),
+    ]
+
+    for name, environ in environs:
+        baseline = min(timeit.repeat(per_request(environ, lambda: None),
+                                     number=number, repeat=5))
+        for label, extract in [('legacy', legacy_extract),
+                               ('pipeline', pipeline_extract)]:
+            best = min(timeit.repeat(per_request(environ, extract),
+                                     number=number, repeat=5))
+            print('{:<14} {:<10} {:6.2f} us/request'.format(
+                name, label, (best - baseline) / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
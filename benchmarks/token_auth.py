@@ -0,0 +1,63 @@
+"""
+Measures tokens/sec for :meth:`ShortlivedTokenMixin.dump` and
+:meth:`ShortlivedTokenMixin.load`, comparing the previous implementation
+(a new ``TokenSchema`` instance marshalling every claim per call) with the
+compiled :class:`~twopi_flask_utils.token_auth.ShortlivedTokenMixin.ClaimCodec`.
+
+Run with ``python benchmarks/token_auth.py``.
+"""
+import datetime
+import timeit
+import jwt
+import pytz
+from marshmallow import fields
+from twopi_flask_utils.token_auth import ShortlivedTokenMixin
+
+SECRET = 'benchmark-secret'
+
+
+class ShortlivedToken(ShortlivedTokenMixin):
+    class TokenSchema(ShortlivedTokenMixin.TokenSchema):
+        rfid = fields.String(attribute='refresh_token_id')
+        user_id = fields.String(attribute='user_id')
+        scopes = fields.List(fields.String(), attribute='scopes')
+
+    def __init__(self, refresh_token_id, user_id, scopes, *args, **kwargs):
+        super(ShortlivedToken, self).__init__(*args, **kwargs)
+        self.refresh_token_id = refresh_token_id
+        self.user_id = user_id
+        self.scopes = scopes
+
+
+def legacy_dump(token):
+    token.issued_at = datetime.datetime.now(pytz.UTC)
+    payload, err = token.TokenSchema().dump(token)
+    return jwt.encode(payload, SECRET).decode('UTF-8')
+
+
+def legacy_load(Cls, token_string):
+    payload = jwt.decode(token_string, SECRET)
+    deserialized, errs = Cls.TokenSchema().load(payload)
+    return Cls(**deserialized)
+
+
+def main(number=5000):
+    token = ShortlivedToken(
+        refresh_token_id='8f0c3a', user_id='user-1', scopes=['read', 'write'],
+        expiry=datetime.datetime.now(pytz.UTC) + datetime.timedelta(hours=1),
+        issuer='benchmark')
+    raw = token.dump(SECRET)
+
+    cases = [
+        ('dump (legacy)', lambda: legacy_dump(token)),
+        ('dump', lambda: token.dump(SECRET)),
+        ('load (legacy)', lambda: legacy_load(ShortlivedToken, raw)),
+        ('load', lambda: ShortlivedToken.load(raw, SECRET)),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<16} {:10.0f} tokens/sec'.format(name, number / best))
+
+
+if __name__ == '__main__':
+    main()
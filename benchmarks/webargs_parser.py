@@ -0,0 +1,63 @@
+"""
+Measures the per-request cost of parsing a ``dict`` argmap, comparing
+webargs' ``FlaskParser`` (which builds a new schema on every ``parse``) with
+:class:`~twopi_flask_utils.webargs.CachingFlaskParser`, for a typical list
+endpoint's arguments and for ``pagination_args``.
+
+The cost of pushing a request context is measured separately and
+subtracted.
+
+Run with ``python benchmarks/webargs_parser.py``.
+"""
+import timeit
+import warnings
+from flask import Flask
+from webargs import fields
+from webargs.flaskparser import FlaskParser
+from werkzeug.test import EnvironBuilder
+from twopi_flask_utils.pagination import pagination_args
+from twopi_flask_utils.webargs import CachingFlaskParser
+
+app = Flask(__name__)
+
+list_args = {
+    'q': fields.String(missing=None),
+    'sort': fields.String(missing='name'),
+    'tags': fields.List(fields.String(), missing=[]),
+    'active': fields.Boolean(missing=True),
+    'offset': fields.Integer(missing=0),
+    'limit': fields.Integer(missing=20),
+}
+
+
+def per_request(environ, parse):
+    def run():
+        with app.request_context(environ):
+            parse()
+    return run
+
+
+def main(number=5000):
+    environ = EnvironBuilder(
+        path='/items', query_string='q=abc&sort=name&tags=a&tags=b&limit=50'
+    ).get_environ()
+
+    parsers = [('FlaskParser', FlaskParser()),
+               ('CachingFlaskParser', CachingFlaskParser())]
+
+    baseline = min(timeit.repeat(per_request(environ, lambda: None),
+                                 number=number, repeat=5))
+    for name, argmap in [('list args', list_args),
+                         ('pagination_args', pagination_args)]:
+        for label, parser in parsers:
+            best = min(timeit.repeat(
+                per_request(environ, lambda: parser.parse(argmap, locations=('query',))),
+                number=number, repeat=5))
+            print('{:<16} {:<20} {:6.1f} us/request'.format(
+                name, label, (best - baseline) / number * 1e6))
+
+
+if __name__ == '__main__':
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        main()
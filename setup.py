@@ -8,11 +8,15 @@ extras = {
     'sentry': ['raven[flask]'],
     'pagination': ['webargs', 'marshmallow'],
     'webargs': ['webargs'],
-    'token_auth': ['marshmallow']
+    'token_auth': ['marshmallow'],
+    'orjson': ['orjson'],
+    'compression': ['brotli', 'zstandard'],
+    'streaming_json': ['ijson'],
 }
 
 packages = [
     'twopi_flask_utils',
+    'twopi_flask_utils.caching',
     'twopi_flask_utils.celery',
     'twopi_flask_utils.config',
     'twopi_flask_utils.deployment_release',
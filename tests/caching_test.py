@@ -0,0 +1,88 @@
+import unittest
+from twopi_flask_utils.caching import BloomFilter, LRUCache
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 'default'), 'default')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=30)
+        cache.set('c', 3, ttl=None)
+
+        timer.now += 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+        timer.now += 1000
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000)
+        items = ['token-{}'.format(i) for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+
+        for item in items:
+            self.assertIn(item, bloom)
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('token-{}'.format(i))
+
+        false_positives = sum(1 for i in range(10000)
+                              if 'other-{}'.format(i) in bloom)
+        self.assertLess(false_positives, 300)
+
+    def test_bytes(self):
+        bloom = BloomFilter(capacity=10)
+        bloom.add(b'abc')
+        self.assertIn('abc', bloom)
+        self.assertNotIn('abd', bloom)
+
+
+if __name__ == '__main__':
+    unittest.main()
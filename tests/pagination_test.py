@@ -0,0 +1,201 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    import sqlalchemy as sa
+    from flask import Flask, jsonify
+    from marshmallow import Schema, fields
+    from sqlalchemy.orm import sessionmaker
+    from twopi_flask_utils.pagination import (
+        ExactCount, _count_concurrently, encode_cursor, paginated, streamed)
+except ImportError:
+    Flask = None
+else:
+    try:
+        from sqlalchemy.orm import declarative_base
+    except ImportError:
+        from sqlalchemy.ext.declarative import declarative_base
+
+    Base = declarative_base()
+
+    class Item(Base):
+        __tablename__ = 'items'
+        id = sa.Column(sa.Integer, primary_key=True)
+        created = sa.Column(sa.DateTime, nullable=False)
+
+    class ItemSchema(Schema):
+        id = fields.Integer()
+
+
+def _data(result):
+    # A MarshalResult on marshmallow 2.
+    return getattr(result, 'data', result)
+
+
+@unittest.skipIf(Flask is None, "pagination's dependencies aren't installed")
+class PaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        start = datetime.datetime(2020, 1, 1)
+        for i in range(1, 8):
+            # Pairs of items share a created time, so the id breaks ties.
+            self.session.add(Item(id=i, created=start + datetime.timedelta(hours=i // 2)))
+        self.session.commit()
+
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.session.close()
+
+
+class TestKeysetPagination(PaginationTestCase):
+    def setUp(self):
+        super(TestKeysetPagination, self).setUp()
+
+        @self.app.route('/items')
+        def items():
+            return jsonify(_data(paginated(
+                self.session.query(Item), ItemSchema,
+                order_by=[Item.created, Item.id], limit=3)))
+
+        @self.app.route('/items/descending')
+        def descending_items():
+            return jsonify(_data(paginated(
+                self.session.query(Item), ItemSchema, order_by=[Item.id],
+                descending=True, limit=3)))
+
+    def get_page(self, path='/items', cursor=None):
+        resp = self.client.get(path, query_string={'cursor': cursor} if cursor else None)
+        self.assertEqual(resp.status_code, 200)
+        page = resp.get_json()
+        return [item['id'] for item in page['items']], page
+
+    def test_forwards_and_backwards(self):
+        ids, first = self.get_page()
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertIsNone(first['prevCursor'])
+        self.assertEqual(first['totalItems'], 7)
+
+        ids, second = self.get_page(cursor=first['nextCursor'])
+        self.assertEqual(ids, [4, 5, 6])
+        self.assertIsNotNone(second['prevCursor'])
+
+        ids, last = self.get_page(cursor=second['nextCursor'])
+        self.assertEqual(ids, [7])
+        self.assertIsNone(last['nextCursor'])
+
+        ids, page = self.get_page(cursor=last['prevCursor'])
+        self.assertEqual(ids, [4, 5, 6])
+        self.assertIsNotNone(page['prevCursor'])
+        self.assertIsNotNone(page['nextCursor'])
+
+        ids, page = self.get_page(cursor=page['prevCursor'])
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertIsNone(page['prevCursor'])
+        self.assertIsNotNone(page['nextCursor'])
+
+    def test_descending(self):
+        ids, first = self.get_page('/items/descending')
+        self.assertEqual(ids, [7, 6, 5])
+
+        ids, second = self.get_page('/items/descending', first['nextCursor'])
+        self.assertEqual(ids, [4, 3, 2])
+
+        ids, page = self.get_page('/items/descending', second['prevCursor'])
+        self.assertEqual(ids, [7, 6, 5])
+        self.assertIsNone(page['prevCursor'])
+
+    def test_tampered_cursor(self):
+        ids, first = self.get_page()
+        cursor = first['nextCursor']
+        tampered = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+
+        for bad in [tampered, 'garbage']:
+            resp = self.client.get('/items', query_string={'cursor': bad})
+            self.assertEqual(resp.status_code, 422)
+
+    def test_cursor_for_other_columns(self):
+        with self.app.test_request_context():
+            cursor = encode_cursor([3])
+
+        resp = self.client.get('/items', query_string={'cursor': cursor})
+        self.assertEqual(resp.status_code, 422)
+
+
+@unittest.skipIf(Flask is None, "pagination's dependencies aren't installed")
+class TestSessionBinds(unittest.TestCase):
+    def setUp(self):
+        from sqlalchemy.pool import NullPool
+
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.engine = sa.create_engine('sqlite:///' + self.path, poolclass=NullPool)
+        Base.metadata.create_all(self.engine)
+        # Bound per mapper rather than with ``bind=``.
+        self.session = sessionmaker(binds={Item: self.engine})()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_count_concurrently(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.session.add(Item(id=1, created=datetime.datetime(2020, 1, 1)))
+        self.session.commit()
+
+        query = self.session.query(Item)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = _count_concurrently(query, ExactCount(), executor)
+            self.assertIsNotNone(future)
+            self.assertEqual(future.result(), (1, False))
+
+
+class StubQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.batch_sizes = []
+
+    def yield_per(self, count):
+        self.batch_sizes.append(count)
+        return iter(self.rows)
+
+
+@unittest.skipIf(Flask is None, "pagination's dependencies aren't installed")
+class TestStreamed(unittest.TestCase):
+    def setUp(self):
+        self.query = StubQuery([Item(id=i) for i in range(1, 6)])
+        self.app = Flask(__name__)
+
+        @self.app.route('/items.<format>')
+        def items(format):
+            return streamed(self.query, ItemSchema, format=format, batch_size=2)
+
+        self.client = self.app.test_client()
+
+    def test_ndjson(self):
+        resp = self.client.get('/items.ndjson')
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': i} for i in range(1, 6)])
+        self.assertEqual(self.query.batch_sizes, [2])
+
+    def test_json(self):
+        resp = self.client.get('/items.json')
+        self.assertEqual(resp.mimetype, 'application/json')
+        self.assertEqual(json.loads(resp.get_data(as_text=True)),
+                         [{'id': i} for i in range(1, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import unittest
+
+try:
+    from flask import Flask, g, jsonify, request
+    from twopi_flask_utils.restful import (
+        PayloadTooLargeException, iter_json_items, output_json)
+    from twopi_flask_utils.restful.cache import ResponseCache
+    from twopi_flask_utils.restful.compression import Compressor
+except ImportError:
+    Flask = None
+
+try:
+    import flask_restful
+except ImportError:
+    flask_restful = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+@unittest.skipIf(Flask is None or ijson is None, "flask or ijson isn't installed")
+class TestIterJSONItems(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.errorhandler(PayloadTooLargeException)(PayloadTooLargeException.handle)
+
+        @app.route('/items', methods=['POST'])
+        def items():
+            return jsonify(list(iter_json_items('items.item', max_size=100)))
+
+        self.client = app.test_client()
+
+    def test_streams_items(self):
+        resp = self.client.post('/items', json={'items': [1, 2, 3]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), [1, 2, 3])
+
+    def test_invalid_json(self):
+        resp = self.client.post('/items', data='{"items": [1,',
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_too_large(self):
+        resp = self.client.post('/items', json={'items': list(range(100))})
+        self.assertEqual(resp.status_code, 413)
+
+
+@unittest.skipIf(Flask is None, "flask isn't installed")
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        Compressor(encodings=['gzip'], min_size=10).init_app(app)
+
+        @app.route('/items')
+        def items():
+            resp = jsonify(list(range(100)))
+            resp.set_etag('items')
+            return resp.make_conditional(request)
+
+        self.client = app.test_client()
+
+    def test_compresses(self):
+        resp = self.client.get('/items', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(resp.get_etag(), ('items', True))
+
+    def test_not_modified_varies(self):
+        resp = self.client.get('/items', headers={'Accept-Encoding': 'gzip',
+                                                  'If-None-Match': 'W/"items"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+
+class StubToken(object):
+    def __init__(self, subject):
+        self.subject = subject
+
+
+@unittest.skipIf(Flask is None, "flask isn't installed")
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.cache = ResponseCache()
+        self.calls = 0
+
+        @self.app.before_request
+        def load_token():
+            user = request.headers.get('X-User')
+            g.token = None if user is None else StubToken(user or None)
+
+        @self.app.route('/me')
+        @self.cache.cached(vary_on_token=True)
+        def me():
+            self.calls += 1
+            return {'subject': g.token and g.token.subject}
+
+        @self.app.route('/items')
+        @self.cache.cached(tags=['items'])
+        def items():
+            self.calls += 1
+            return {'calls': self.calls}, 200, {'X-Total': '1'}
+
+        @self.app.route('/stale')
+        @self.cache.cached(ttl=0, stale_ttl=300)
+        def stale():
+            self.calls += 1
+            return {'calls': self.calls}
+
+        @self.app.route('/login')
+        @self.cache.cached()
+        def login():
+            self.calls += 1
+            resp = jsonify(True)
+            resp.set_cookie('session', 'secret')
+            return resp
+
+        self.client = self.app.test_client()
+
+    def get(self, path, user=None):
+        resp = self.client.get(path, headers={'X-User': user} if user is not None else None)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def cache_key(self, path):
+        with self.app.test_request_context(path):
+            return self.cache.cache_key({})
+
+    def test_varies_on_token(self):
+        self.assertEqual(self.get('/me').get_json(), {'subject': None})
+        self.assertEqual(self.get('/me', 'alice').get_json(), {'subject': 'alice'})
+        self.assertEqual(self.get('/me', 'bob').get_json(), {'subject': 'bob'})
+        self.assertEqual(self.calls, 3)
+
+        self.assertEqual(self.get('/me').get_json(), {'subject': None})
+        self.assertEqual(self.get('/me', 'alice').get_json(), {'subject': 'alice'})
+        self.assertEqual(self.calls, 3)
+
+    def test_token_without_subject_isnt_cached(self):
+        self.get('/me', '')
+        self.get('/me', '')
+        self.assertEqual(self.calls, 2)
+
+    def test_invalidate_tags(self):
+        self.get('/items')
+        self.assertEqual(self.get('/items').get_json(), {'calls': 1})
+
+        self.cache.invalidate_tags('items')
+        self.assertEqual(self.get('/items').get_json(), {'calls': 2})
+
+    def test_stale_while_revalidate(self):
+        self.get('/stale')
+
+        # The entry is stale (ttl=0), but is served while another request
+        # is recomputing it.
+        key = self.cache_key('/stale')
+        self.cache.backend.lock(key, 10)
+        self.assertEqual(self.get('/stale').get_json(), {'calls': 1})
+        self.cache.backend.unlock(key)
+
+        self.assertEqual(self.get('/stale').get_json(), {'calls': 2})
+
+    def test_stores_headers(self):
+        first = self.get('/items')
+        second = self.get('/items')
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.headers['X-Total'], '1')
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(second.mimetype, 'application/json')
+
+    def test_set_cookie_isnt_cached(self):
+        self.assertIn('session=secret', self.get('/login').headers['Set-Cookie'])
+        self.assertIn('session=secret', self.get('/login').headers['Set-Cookie'])
+        self.assertEqual(self.calls, 2)
+
+
+@unittest.skipIf(Flask is None or flask_restful is None, "flask-restful isn't installed")
+class TestResponseCacheOutputJSON(unittest.TestCase):
+    def test_hit_returns_stored_body(self):
+        app = Flask(__name__)
+        api = flask_restful.Api(app)
+        api.representations['application/json'] = output_json
+        cache = ResponseCache()
+        calls = []
+
+        class Items(flask_restful.Resource):
+            method_decorators = [cache.cached()]
+
+            def get(self):
+                calls.append(1)
+                return {'items': [1, 2, 3]}
+
+        api.add_resource(Items, '/items')
+        client = app.test_client()
+
+        first = client.get('/items')
+        second = client.get('/items')
+        self.assertEqual(len(calls), 1)
+
+        with app.test_request_context('/items'):
+            entry = cache.backend.get(cache.cache_key({}))
+        self.assertEqual(second.data, entry.body)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.get_json(), {'items': [1, 2, 3]})
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
@@ -0,0 +1,148 @@
+import time
+import unittest
+from collections import namedtuple
+
+try:
+    from twopi_flask_utils.token_auth.revocation import (
+        MemoryRevocationBackend, RedisRevocationBackend, RevocationList,
+        SQLRevocationBackend)
+except ImportError:
+    # token_auth's dependencies aren't installed.
+    RevocationList = None
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    import sqlalchemy
+except ImportError:
+    sqlalchemy = None
+
+Token = namedtuple('Token', ['token_id'])
+
+
+@unittest.skipIf(RevocationList is None, "token_auth's dependencies aren't installed")
+class TestRevocationList(unittest.TestCase):
+    def test_revoke(self):
+        revocation = RevocationList(MemoryRevocationBackend())
+        revocation.revoke('a')
+
+        self.assertTrue(revocation.is_revoked(Token('a')))
+        self.assertFalse(revocation.is_revoked(Token('b')))
+        self.assertFalse(revocation.is_revoked(Token(None)))
+
+    def test_only_checks_backend_on_filter_hits(self):
+        revocation = RevocationList(MemoryRevocationBackend())
+        revocation.revoke('a')
+
+        for i in range(100):
+            revocation.is_revoked(Token('token-{}'.format(i)))
+        self.assertEqual(revocation.checks, 100)
+        self.assertEqual(revocation.backend_checks, revocation.false_positives)
+
+        revocation.is_revoked(Token('a'))
+        self.assertEqual(revocation.backend_checks - revocation.false_positives, 1)
+
+    def test_refreshes_from_backend(self):
+        backend = MemoryRevocationBackend()
+        revocation = RevocationList(backend, refresh_interval=60)
+        self.assertFalse(revocation.is_revoked(Token('a')))
+
+        # Revoked by another process.
+        backend.revoke('a')
+        self.assertFalse(revocation.is_revoked(Token('a')))
+
+        revocation._refreshed_at = time.time() - 60
+        self.assertTrue(revocation.is_revoked(Token('a')))
+
+    def test_repeated_ids_are_counted_once(self):
+        backend = MemoryRevocationBackend()
+        # Return every id on every refresh.
+        backend.revoked_since = lambda cursor=None: (list(backend._log), None)
+        for i in range(10):
+            backend.revoke('token-{}'.format(i))
+
+        revocation = RevocationList(backend, capacity=15)
+        for i in range(3):
+            revocation.refresh()
+
+        self.assertEqual(revocation._bloom.count, 10)
+        self.assertEqual(revocation.capacity, 15)
+
+    def test_rebuilds_saturated_filter(self):
+        backend = MemoryRevocationBackend()
+        revocation = RevocationList(backend, refresh_interval=0, capacity=10)
+        for i in range(25):
+            backend.revoke('token-{}'.format(i))
+        revocation.refresh()
+
+        self.assertGreaterEqual(revocation.capacity, 25)
+        for i in range(25):
+            self.assertTrue(revocation.is_revoked(Token('token-{}'.format(i))))
+
+
+@unittest.skipIf(RevocationList is None or fakeredis is None,
+                 "token_auth's dependencies or fakeredis aren't installed")
+class TestRedisRevocationBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = RedisRevocationBackend(fakeredis.FakeStrictRedis())
+
+    def test_revoke(self):
+        self.backend.revoke('a')
+        self.assertTrue(self.backend.is_revoked('a'))
+        self.assertFalse(self.backend.is_revoked('b'))
+
+    def test_revoked_since(self):
+        self.backend.revoke('a')
+        self.backend.revoke('b')
+        ids, cursor = self.backend.revoked_since()
+        self.assertEqual(ids, ['a', 'b'])
+
+        self.assertEqual(self.backend.revoked_since(cursor), ([], cursor))
+
+        self.backend.revoke('c')
+        ids, cursor = self.backend.revoked_since(cursor)
+        self.assertEqual(ids, ['c'])
+
+
+@unittest.skipIf(RevocationList is None or sqlalchemy is None,
+                 "token_auth's dependencies or sqlalchemy aren't installed")
+class TestSQLRevocationBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = SQLRevocationBackend(sqlalchemy.create_engine('sqlite://'))
+        self.backend.table.create(self.backend.engine)
+
+    def test_revoke(self):
+        self.backend.revoke('a')
+        self.backend.revoke('a')
+        self.assertTrue(self.backend.is_revoked('a'))
+        self.assertFalse(self.backend.is_revoked('b'))
+
+    def test_rereads_late_commits(self):
+        self.backend.revoke('a')
+        self.backend.revoke('b')
+        ids, cursor = self.backend.revoked_since()
+        self.assertEqual(ids, ['a', 'b'])
+
+        # An insert which was assigned an id before 'b', but committed after
+        # it was read.
+        with self.backend.engine.begin() as conn:
+            conn.execute(self.backend.table.delete().where(
+                self.backend.table.c.token_id == 'a'))
+            conn.execute(self.backend.table.insert().values(
+                id=cursor - 1, token_id='c', revoked_at=time.time()))
+
+        ids, cursor = self.backend.revoked_since(cursor)
+        self.assertIn('c', ids)
+
+    def test_overlap(self):
+        backend = self.backend
+        backend.overlap = 0
+        backend.revoke('a')
+        ids, cursor = backend.revoked_since()
+
+        time.sleep(0.01)
+        backend.revoke('b')
+        self.assertEqual(backend.revoked_since(cursor), (['b'], cursor + 1))
@@ -0,0 +1,331 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import sys
+import time
+import unittest
+
+try:
+    import pytz
+    from flask import Flask, g, jsonify
+    from twopi_flask_utils.caching import LRUCache
+    from twopi_flask_utils.token_auth import (
+        HeaderTokenSource, InvalidToken, Keyring, ShortlivedTokenMixin, auth_required,
+        current_token, parse_auth_header)
+except ImportError:
+    # token_auth's dependencies aren't installed.
+    ShortlivedTokenMixin = None
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+except ImportError:
+    rsa = None
+
+
+def _token(Token, seconds=60, **kwargs):
+    expiry = datetime.datetime.fromtimestamp(int(time.time()) + seconds, pytz.UTC)
+    return Token(expiry=expiry, **kwargs)
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@unittest.skipIf(ShortlivedTokenMixin is None, "token_auth's dependencies aren't installed")
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+
+        class Token(ShortlivedTokenMixin):
+            TOKEN_CACHE = LRUCache(timer=self.timer)
+
+        self.Token = Token
+        self.cache = Token.TOKEN_CACHE
+
+    def test_hits_and_misses(self):
+        token_string = _token(self.Token).dump('secret')
+
+        first = self.Token.verify(token_string, 'secret')
+        self.assertIs(self.Token.verify(token_string, 'secret'), first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.Token.verify(_token(self.Token, subject='other').dump('secret'), 'secret')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_expires_at_exp(self):
+        token = _token(self.Token)
+        token_string = token.dump('secret')
+        exp = (token.expiry - datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)).total_seconds()
+
+        self.Token.verify(token_string, 'secret')
+        self.timer.now = exp - 0.5
+        self.Token.verify(token_string, 'secret')
+        self.assertEqual(self.cache.hits, 1)
+
+        self.timer.now = exp
+        self.Token.verify(token_string, 'secret')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_issuer_and_audience_are_part_of_the_key(self):
+        token_string = _token(self.Token, issuer='issuer', audience='aud').dump('secret')
+        self.Token.verify(token_string, 'secret', issuer='issuer', audience='aud')
+
+        with self.assertRaises(InvalidToken):
+            self.Token.verify(token_string, 'secret', issuer='other', audience='aud')
+        with self.assertRaises(InvalidToken):
+            self.Token.verify(token_string, 'secret', issuer='issuer', audience='other')
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_secret_is_part_of_the_key(self):
+        token_string = _token(self.Token).dump('secret')
+        self.Token.verify(token_string, 'secret')
+
+        with self.assertRaises(InvalidToken):
+            self.Token.verify(token_string, 'other-secret')
+
+
+@unittest.skipIf(ShortlivedTokenMixin is None, "token_auth's dependencies aren't installed")
+class TestKeyring(unittest.TestCase):
+    def test_rotation(self):
+        old = Keyring({'1': 'old-secret'})
+        rotated = Keyring({'1': 'old-secret', '2': 'new-secret'}, active='2')
+
+        old_token = _token(ShortlivedTokenMixin).dump(old)
+        new_token = _token(ShortlivedTokenMixin).dump(rotated)
+        self.assertIsNotNone(ShortlivedTokenMixin.verify(old_token, rotated))
+        self.assertIsNotNone(ShortlivedTokenMixin.verify(new_token, rotated))
+
+        # Once the old key is removed.
+        with self.assertRaises(InvalidToken):
+            ShortlivedTokenMixin.verify(old_token, Keyring({'2': 'new-secret'}))
+
+    def test_unknown_kid(self):
+        token_string = _token(ShortlivedTokenMixin).dump(Keyring({'1': 'secret'}))
+        with self.assertRaises(InvalidToken):
+            ShortlivedTokenMixin.verify(token_string, Keyring({'2': 'secret'}))
+
+    def test_default_kid(self):
+        token_string = _token(ShortlivedTokenMixin).dump('secret')
+        keyring = Keyring({'1': 'secret', '2': 'new-secret'}, active='2', default_kid='1')
+        self.assertIsNotNone(ShortlivedTokenMixin.verify(token_string, keyring))
+
+    def test_plain_secret_rejects_kid(self):
+        token_string = _token(ShortlivedTokenMixin).dump(Keyring({'1': 'secret'}))
+        with self.assertRaises(InvalidToken):
+            ShortlivedTokenMixin.verify(token_string, 'secret')
+
+
+@unittest.skipIf(ShortlivedTokenMixin is None or rsa is None,
+                 "token_auth's dependencies or cryptography aren't installed")
+class TestAsymmetricKeyring(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        private_key = rsa.generate_private_key(65537, 2048, default_backend())
+        cls.private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+        cls.public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def test_public_only_keyring(self):
+        issuer = Keyring({'1': self.private_pem}, algorithm='RS256')
+        verifier = Keyring({'1': self.public_pem}, algorithm='RS256')
+
+        token_string = _token(ShortlivedTokenMixin).dump(issuer)
+        self.assertIsNotNone(ShortlivedTokenMixin.verify(token_string, verifier))
+        self.assertIsNotNone(ShortlivedTokenMixin.verify(token_string, issuer))
+
+        with self.assertRaises(ValueError):
+            _token(ShortlivedTokenMixin).dump(verifier)
+
+    def test_algorithm_confusion(self):
+        # An HS256 token signed with the (public) RS256 key as its secret.
+        def b64(data):
+            return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+        signing_input = b64(b'{"alg":"HS256","kid":"1","typ":"JWT"}') + b'.' + \
+            b64(json.dumps({'exp': int(time.time()) + 60}).encode('UTF-8'))
+        signature = hmac.new(self.public_pem, signing_input, hashlib.sha256).digest()
+        token_string = (signing_input + b'.' + b64(signature)).decode('UTF-8')
+
+        verifier = Keyring({'1': self.public_pem}, algorithm='RS256')
+        with self.assertRaises(InvalidToken):
+            ShortlivedTokenMixin.verify(token_string, verifier)
+
+
+@unittest.skipIf(ShortlivedTokenMixin is None, "token_auth's dependencies aren't installed")
+class TestHeaderTokenSource(unittest.TestCase):
+    def read(self, value, source=None):
+        with Flask(__name__).test_request_context(headers={'Authorization': value}):
+            return (source or HeaderTokenSource())()
+
+    def test_valid(self):
+        self.assertEqual(self.read('Bearer abc'), 'abc')
+        self.assertEqual(self.read('bearer abc'), 'abc')
+        self.assertEqual(self.read('Token abc', HeaderTokenSource(scheme='Token')), 'abc')
+
+    def test_malformed(self):
+        for value in ['Bearer', 'Bearer ', 'Bearer abc ', 'Bearer  abc', 'Bearer abc\t',
+                      'Bearer a b', 'Basic abc', 'abc']:
+            self.assertIsNone(self.read(value), value)
+
+
+def coroutine_view(view):
+    """
+    ``view`` as an ``async def`` function. It is defined with ``exec`` so
+    this module can still be imported on Python 2.
+    """
+    namespace = {'view': view}
+    exec('async def coroutine(*args, **kwargs):\n'
+         '    return view(*args, **kwargs)\n', namespace)
+    return namespace['coroutine']
+
+
+class StubToken(object):
+    def __init__(self, scopes=None, issuer=None):
+        self.scopes = scopes
+        self.issuer = issuer
+
+
+@unittest.skipIf(ShortlivedTokenMixin is None, "token_auth's dependencies aren't installed")
+class DecoratorTestCase(unittest.TestCase):
+    TOKENS = {
+        'user': StubToken(),
+        'admin': StubToken(['admin', 'read'], issuer='twopi'),
+        'other-issuer': StubToken(['admin', 'read'], issuer='other'),
+    }
+
+    def setUp(self):
+        test = self
+        self.loaded = []
+
+        class Token(object):
+            @classmethod
+            def load(Cls, raw_token, secret=None):
+                test.loaded.append(raw_token)
+                return test.TOKENS.get(raw_token)
+
+        self.Token = Token
+        self.app = Flask(__name__)
+        self.app.errorhandler(InvalidToken)(InvalidToken.handle)
+        self.client = self.app.test_client()
+
+    def get(self, path, token=None):
+        headers = {'Authorization': 'Bearer ' + token} if token else None
+        return self.client.get(path, headers=headers)
+
+    def call_async(self, view, token=None):
+        """
+        Call a decorated coroutine view directly, as Flask only runs them
+        with ``asgiref`` installed.
+        """
+        import asyncio
+
+        headers = {'Authorization': 'Bearer ' + token} if token else None
+        with self.app.test_request_context(headers=headers):
+            loop = asyncio.new_event_loop()
+            try:
+                rv = loop.run_until_complete(view())
+            except InvalidToken as exc:
+                rv = exc.handle(exc)
+            finally:
+                loop.close()
+            return self.app.make_response(rv)
+
+
+class TestLazyToken(DecoratorTestCase):
+    def setUp(self):
+        super(TestLazyToken, self).setUp()
+
+        @self.app.route('/public')
+        @parse_auth_header(self.Token, lazy=True)
+        def public():
+            return jsonify(g.raw_token)
+
+        @self.app.route('/me')
+        @parse_auth_header(self.Token, lazy=True)
+        def me():
+            return jsonify(current_token() is not None)
+
+    def test_unused_token_isnt_loaded(self):
+        resp = self.get('/public', 'invalid')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), 'invalid')
+        self.assertEqual(self.loaded, [])
+
+    def test_used_token_is_loaded(self):
+        resp = self.get('/me', 'user')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.loaded, ['user'])
+
+        self.assertEqual(self.get('/me', 'invalid').status_code, 401)
+        self.assertEqual(self.get('/me').get_json(), False)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "coroutines require Python 3.5")
+    def test_async(self):
+        public = parse_auth_header(self.Token, lazy=True)(
+            coroutine_view(lambda: jsonify(g.raw_token)))
+        me = parse_auth_header(self.Token, lazy=True)(
+            coroutine_view(lambda: jsonify(current_token() is not None)))
+
+        self.assertEqual(self.call_async(public, 'invalid').status_code, 200)
+        self.assertEqual(self.loaded, [])
+
+        self.assertEqual(self.call_async(me, 'user').status_code, 200)
+        self.assertEqual(self.call_async(me, 'invalid').status_code, 401)
+        self.assertEqual(self.loaded, ['user', 'invalid'])
+
+
+class TestAuthRequired(DecoratorTestCase):
+    def setUp(self):
+        super(TestAuthRequired, self).setUp()
+
+        @self.app.route('/admin')
+        @parse_auth_header(self.Token)
+        @auth_required(scopes=['admin'], claims={'issuer': ['twopi', 'partner']})
+        def admin():
+            return jsonify(True)
+
+        @self.app.route('/lazy-admin')
+        @parse_auth_header(self.Token, lazy=True)
+        @auth_required(scopes=['admin'])
+        def lazy_admin():
+            return jsonify(True)
+
+    def test_scopes_and_claims(self):
+        self.assertEqual(self.get('/admin', 'admin').status_code, 200)
+        self.assertEqual(self.get('/admin').status_code, 401)
+        self.assertEqual(self.get('/admin', 'invalid').status_code, 401)
+        # Missing a scope.
+        self.assertEqual(self.get('/admin', 'user').status_code, 403)
+        # Has the scopes, but not the claim.
+        self.assertEqual(self.get('/admin', 'other-issuer').status_code, 403)
+
+    def test_lazy(self):
+        self.assertEqual(self.get('/lazy-admin', 'admin').status_code, 200)
+        self.assertEqual(self.get('/lazy-admin', 'user').status_code, 403)
+        self.assertEqual(self.get('/lazy-admin', 'invalid').status_code, 401)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "coroutines require Python 3.5")
+    def test_async(self):
+        admin = parse_auth_header(self.Token)(
+            auth_required(scopes=['admin'], claims={'issuer': 'twopi'})(
+                coroutine_view(lambda: jsonify(True))))
+
+        self.assertEqual(self.call_async(admin, 'admin').status_code, 200)
+        self.assertEqual(self.call_async(admin).status_code, 401)
+        self.assertEqual(self.call_async(admin, 'invalid').status_code, 401)
+        self.assertEqual(self.call_async(admin, 'user').status_code, 403)
+        self.assertEqual(self.call_async(admin, 'other-issuer').status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+try:
+    import marshmallow as ma
+    from flask import Flask, jsonify
+    from webargs.core import ValidationError
+    from twopi_flask_utils.restful import ExpectedJSONException
+    from twopi_flask_utils.webargs import handle_validation_error, use_bulk_args
+except ImportError:
+    Flask = None
+
+
+@unittest.skipIf(Flask is None, "flask, marshmallow or webargs isn't installed")
+class TestBulkArgs(unittest.TestCase):
+    def setUp(self):
+        class ItemSchema(ma.Schema):
+            name = ma.fields.String(required=True)
+            n = ma.fields.Integer()
+
+        app = Flask(__name__)
+        app.errorhandler(ValidationError)(handle_validation_error)
+        app.errorhandler(ExpectedJSONException)(ExpectedJSONException.handle)
+
+        @app.route('/items', methods=['POST'])
+        @use_bulk_args(ItemSchema, max_errors=2, chunk_size=2)
+        def items(items):
+            return jsonify(len(items))
+
+        @app.route('/items/threaded', methods=['POST'])
+        @use_bulk_args(ItemSchema, max_errors=2, chunk_size=2, threaded=True)
+        def threaded_items(items):
+            return jsonify(len(items))
+
+        self.client = app.test_client()
+
+    def test_valid(self):
+        for path in ['/items', '/items/threaded']:
+            resp = self.client.post(path, json=[{'name': 'a'}, {'name': 'b', 'n': 1}])
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json(), 2)
+
+    def test_invalid_items(self):
+        body = [{'name': 'a'}, {'n': 1}, {'name': 'c'}, {'name': 'd', 'n': 'x'},
+                {'n': 2}, {'n': 3}]
+        for path in ['/items', '/items/threaded']:
+            resp = self.client.post(path, json=body)
+            self.assertEqual(resp.status_code, 422)
+
+            report = resp.get_json()
+            self.assertTrue(report['truncated'])
+            self.assertEqual(sorted(report['items']), ['1', '3'])
+            self.assertIn('name', report['items']['1'])
+            self.assertIn('n', report['items']['3'])
+
+    def test_errors_in_last_chunk(self):
+        body = [{'name': 'a'}, {'name': 'b'}, {'n': 1}, {'n': 2}]
+        for path in ['/items', '/items/threaded']:
+            resp = self.client.post(path, json=body)
+            self.assertEqual(resp.status_code, 422)
+
+            report = resp.get_json()
+            self.assertFalse(report['truncated'])
+            self.assertEqual(sorted(report['items']), ['2', '3'])
+
+    def test_not_an_array(self):
+        for path in ['/items', '/items/threaded']:
+            resp = self.client.post(path, json={'not': 'a list'})
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,24 @@
+import threading
+
+
+class LazyThreadPool(object):
+    """
+    A process-wide ``ThreadPoolExecutor`` which is only started the first
+    time it is needed, so importing a module which uses one costs nothing.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, max_workers):
+        """
+        Return the executor, creating it with ``max_workers`` threads if it
+        hasn't been started yet.
+        """
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        return self._executor
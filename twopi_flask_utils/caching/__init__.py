@@ -0,0 +1,135 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, in-process cache which evicts the least recently
+    used entry once ``maxsize`` is reached. Entries may optionally expire
+    after a time-to-live.
+
+    :param maxsize: ``int``: The maximum number of entries to hold.
+    :param ttl: (optional) The default number of seconds an entry lives for.
+                ``None`` means entries never expire (Default: ``None``)
+    :param timer: (optional) A callable returning the current time in
+                  seconds. (Default: ``time.time``)
+
+    ``hits`` and ``misses`` count the results of every :meth:`get`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Fetch ``key`` from the cache, marking it as recently used.
+
+        :returns: The cached value or ``default`` if it is missing or expired.
+        """
+        with self._lock:
+            value, expires = self._data.get(key, (_missing, None))
+            if value is not _missing and expires is not None \
+                    and expires <= self.timer():
+                del self._data[key]
+                value = _missing
+
+            if value is _missing:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            # Re-insert to move the key to the most recently used end.
+            del self._data[key]
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=_missing):
+        """
+        Store ``value`` under ``key``.
+
+        :param ttl: (optional) Seconds until this entry expires. Defaults to
+                    the cache's ``ttl``.
+        """
+        if ttl is _missing:
+            ttl = self.ttl
+        expires = None if ttl is None else self.timer() + ttl
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove ``key`` from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every entry and reset the hit/miss counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BloomFilter(object):
+    """
+    A space efficient set which can answer "definitely not present" or
+    "probably present". Items can't be removed.
+
+    :param capacity: ``int``: The number of items expected to be added.
+    :param error_rate: ``float``: The acceptable false positive rate once
+                       ``capacity`` items have been added.
+                       (Default: ``0.001``)
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / float(capacity) * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        if not isinstance(item, bytes):
+            item = item.encode('UTF-8')
+
+        # Derive every position from two halves of one digest (Kirsch &
+        # Mitzenmacher double hashing).
+        digest = hashlib.sha1(item).hexdigest()
+        h1 = int(digest[:20], 16)
+        h2 = int(digest[20:], 16)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add ``item`` (a string or bytes) to the filter."""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+__all__ = ['LRUCache', 'BloomFilter']
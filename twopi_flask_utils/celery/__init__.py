@@ -1,6 +1,25 @@
+import threading
 from celery import Celery
+from celery.signals import worker_process_init
 from twopi_flask_utils.deployment_release import get_release
 
+#: Config keys read by :func:`engine_options`, and the ``create_engine``
+#: arguments they are passed as.
+ENGINE_OPTIONS = (
+    ('SQLALCHEMY_POOL_RECYCLE', 'pool_recycle'),
+    ('SQLALCHEMY_POOL_SIZE', 'pool_size'),
+    ('SQLALCHEMY_MAX_OVERFLOW', 'max_overflow'),
+    ('SQLALCHEMY_POOL_TIMEOUT', 'pool_timeout'),
+    ('SQLALCHEMY_POOL_PRE_PING', 'pool_pre_ping'),
+)
+
+_engines = {}
+_engines_lock = threading.Lock()
+# Pools inherited from the parent process, which are kept referenced so
+# their connections aren't closed (and closed for the parent too) when they
+# are garbage collected.
+_inherited_pools = []
+
 def create_celery(name, config_obj, inject_version=True, **kwargs):
     """Creates a celery app.
     
@@ -21,32 +40,108 @@ def create_celery(name, config_obj, inject_version=True, **kwargs):
     return celery
 
 
+def engine_options(conf):
+    """
+    Build the ``create_engine`` arguments from a celery app's config.
+
+    Reads ``SQLALCHEMY_POOL_RECYCLE``, ``SQLALCHEMY_POOL_SIZE``,
+    ``SQLALCHEMY_MAX_OVERFLOW``, ``SQLALCHEMY_POOL_TIMEOUT`` and
+    ``SQLALCHEMY_POOL_PRE_PING``. If ``SQLALCHEMY_NULL_POOL`` is set, a
+    ``NullPool`` is used, which opens a new connection for every checkout.
+    This suits deployments behind a connection pooler such as PgBouncer. The
+    pool size, overflow and timeout don't apply to it and are ignored.
+
+    :param conf: The celery app's ``conf``.
+    :returns: A dict of keyword arguments for ``create_engine``.
+    """
+    kwargs = {}
+    for key, option in ENGINE_OPTIONS:
+        value = conf.get(key)
+        if value is not None:
+            kwargs[option] = value
+
+    if conf.get('SQLALCHEMY_NULL_POOL'):
+        from sqlalchemy.pool import NullPool
+
+        kwargs['poolclass'] = NullPool
+        for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+            kwargs.pop(option, None)
+
+    return kwargs
+
+
+def get_engine(uri, **kwargs):
+    """
+    Get the engine for the database ``uri``, creating it on first use.
+    Engines are shared by everything in the process which uses the same
+    database, rather than each creating its own pool.
+
+    :param uri: The database URI.
+    :param kwargs: Arguments to pass to ``create_engine`` if the engine
+                   doesn't exist yet.
+    :returns: A SQLAlchemy ``Engine``.
+    """
+    engine = _engines.get(uri)
+    if engine is None:
+        from sqlalchemy import create_engine
+
+        with _engines_lock:
+            engine = _engines.get(uri)
+            if engine is None:
+                engine = _engines[uri] = create_engine(uri, **kwargs)
+    return engine
+
+
+def dispose_engines():
+    """
+    Give every engine created by :func:`get_engine` a new, empty pool.
+
+    This runs in each celery worker process when it starts (on
+    ``worker_process_init``), since a pool inherited from the parent
+    process across a fork shares its connections with the parent, which
+    corrupts them. The inherited connections are abandoned rather than
+    closed, so the parent's connections are left intact.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            try:
+                engine.dispose(close=False)
+            except TypeError:
+                # SQLAlchemy < 1.4.33 always closes the connections.
+                _inherited_pools.append(engine.pool)
+                engine.pool = engine.pool.recreate()
+
+
+@worker_process_init.connect(weak=False)
+def _reset_engines_after_fork(**kwargs):
+    dispose_engines()
+
+
 def create_db_session(celery):
     """
     Creates an SQLA Database scoped session. Requires SQLAlchemy.
 
-    Uses ``SQLALCHEMY_DATABASE_URI`` and ``SQLALCHEMY_POOL_RECYCLE`` to create an 
-    apropriate engine. 
+    Uses ``SQLALCHEMY_DATABASE_URI`` and the pool options read by
+    :func:`engine_options` to create an apropriate engine. The engine is
+    shared by every session for the same database (see :func:`get_engine`),
+    and each worker process gets its own pool.
 
     If you are using MySQL and ``SQLALCHEMY_POOL_RECYCLE`` is not specified, 
     you'll have a bad time - this is required, as MySQL kills old sessions.
 
+    With a threaded (or gevent/eventlet) worker pool, set
+    ``SQLALCHEMY_POOL_SIZE`` to the worker's concurrency, so each task can
+    hold a connection.
+
     :param celery: The celery application to create the app on
     :returns: A SQLAlchemy scoped_session instance.
 
     """
 
-    from sqlalchemy import create_engine
     from sqlalchemy.orm import scoped_session
     from sqlalchemy.orm import sessionmaker
 
-    kwargs = {}
-    if celery.conf.get('SQLALCHEMY_POOL_RECYCLE'):
-        kwargs['pool_recycle'] = celery.conf.get('SQLALCHEMY_POOL_RECYCLE')
-
-    engine = create_engine(
-        celery.conf.get('SQLALCHEMY_DATABASE_URI'), 
-        **kwargs
-    )
+    engine = get_engine(celery.conf.get('SQLALCHEMY_DATABASE_URI'),
+                        **engine_options(celery.conf))
     return scoped_session(sessionmaker(
         autocommit=False, autoflush=False, bind=engine))
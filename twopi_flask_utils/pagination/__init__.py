@@ -1,51 +1,646 @@
-from flask import request
+import datetime
+import decimal
+import hashlib
+import threading
+import uuid
+from flask import Response, current_app, json, request, stream_with_context
+from itsdangerous import BadData, URLSafeSerializer
 from marshmallow import Schema, fields
 from webargs import fields as wfields
-from webargs.flaskparser import parser
+from webargs.core import ValidationError
+from twopi_flask_utils.webargs import CachingFlaskParser, MARSHMALLOW_VERSION_INFO
+from twopi_flask_utils.caching import LRUCache
+from twopi_flask_utils._executors import LazyThreadPool
+
+try:
+    from datetime import timezone
+    UTC = timezone.utc
+except ImportError:
+    from pytz import UTC
 
 pagination_args = {
     'offset': wfields.Integer(missing=0),
-    'limit': wfields.Integer(missing=20)
+    'limit': wfields.Integer(missing=20),
+    'cursor': wfields.String(missing=None),
 }
 
-def paginated(basequery, schema_type, offset=None, limit=None):
+# Aborts with a 422 on invalid arguments, like webargs' own parser, but only
+# builds the schema for pagination_args once.
+parser = CachingFlaskParser()
+
+# webargs >= 6 parses a single location, which defaults to the JSON body.
+_parse_kwargs = {} if hasattr(CachingFlaskParser, 'parse_querystring') \
+    else {'location': 'query'}
+
+CURSOR_SALT = 'twopi-flask-utils.pagination.cursor'
+
+EPOCH_DT = datetime.datetime(1970, 1, 1)
+EPOCH_DT_UTC = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _micros(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _dump_cursor_value(value):
+    # Tag values which JSON can't represent so they survive the round trip
+    # through the cursor with the same type they are compared against.
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return ['dt', _micros(value - EPOCH_DT)]
+        return ['dtz', _micros(value - EPOCH_DT_UTC)]
+    if isinstance(value, datetime.date):
+        return ['d', value.toordinal()]
+    if isinstance(value, uuid.UUID):
+        return ['u', value.hex]
+    if isinstance(value, decimal.Decimal):
+        return ['n', str(value)]
+    return ['v', value]
+
+
+def _load_cursor_value(tagged):
+    tag, value = tagged
+    if tag == 'dt':
+        return EPOCH_DT + datetime.timedelta(microseconds=value)
+    if tag == 'dtz':
+        return EPOCH_DT_UTC + datetime.timedelta(microseconds=value)
+    if tag == 'd':
+        return datetime.date.fromordinal(value)
+    if tag == 'u':
+        return uuid.UUID(value)
+    if tag == 'n':
+        return decimal.Decimal(value)
+    if tag == 'v':
+        return value
+    raise ValueError("Unknown cursor value tag {}".format(tag))
+
+
+def _cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=CURSOR_SALT)
+
+
+def encode_cursor(values, backwards=False):
+    """
+    Encode the ordering ``values`` of a row into an opaque, signed cursor.
+
+    :param values: A sequence of the row's values for each ordering column.
+    :param backwards: ``bool``: If ``True`` the cursor selects the page
+                      before the row instead of the page after it.
+    :returns: The cursor string.
+    """
+    return _cursor_serializer().dumps({
+        'v': [_dump_cursor_value(v) for v in values],
+        'b': backwards,
+    })
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by :func:`encode_cursor`.
+
+    Raises a ``ValidationError`` if the cursor was tampered with or is
+    otherwise malformed.
+
+    :param cursor: The cursor string.
+    :returns: A tuple of ``(values, backwards)``.
+    """
+    try:
+        payload = _cursor_serializer().loads(cursor)
+        values = [_load_cursor_value(v) for v in payload['v']]
+        return values, bool(payload['b'])
+    except (BadData, KeyError, TypeError, ValueError):
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+
+
+class CountStrategy(object):
+    """
+    Decides how ``totalItems`` is computed for a paginated query.
+
+    Subclasses implement :meth:`count`.
+    """
+
+    def count(self, query):
+        """
+        Count the rows ``query`` would return.
+
+        :param query: The base sqlalchemy query being paginated.
+        :returns: A tuple of ``(total, estimated)``.
+        """
+        raise NotImplementedError()
+
+
+class ExactCount(CountStrategy):
+    """
+    Count with ``query.count()``. This is the default strategy.
+    """
+
+    def count(self, query):
+        return query.count(), False
+
+
+def _query_bind(query):
+    # Resolve the bind the way the session will when running the query, so
+    # sessions configured with ``binds=`` work too.
+    return query.session.get_bind(clause=query.statement)
+
+
+def query_cache_key(query):
+    """
+    Build a cache key for ``query`` from its compiled SQL and bound
+    parameters.
+
+    :param query: A sqlalchemy query.
+    :returns: A hex digest string.
+    """
+    compiled = query.statement.compile(bind=_query_bind(query))
+    params = sorted((k, repr(v)) for k, v in compiled.params.items())
+    raw = '{}\n{}'.format(compiled, params)
+    return hashlib.sha1(raw.encode('UTF-8')).hexdigest()
+
+
+class CachedCount(CountStrategy):
+    """
+    Cache counts in-process, keyed on the query's compiled SQL and bound
+    parameters (see :func:`query_cache_key`). Repeated page flips over the
+    same query only count once per ``ttl``.
+
+    :param counter: (optional) The strategy to use on a cache miss.
+                    (Default: :class:`ExactCount`)
+    :param maxsize: (optional) The maximum number of counts to keep.
+    :param ttl: (optional) Seconds a count is cached for. (Default: ``60``)
+    """
+
+    def __init__(self, counter=None, maxsize=1024, ttl=60):
+        self.counter = counter or ExactCount()
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def count(self, query):
+        key = query_cache_key(query)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.counter.count(query)
+            self.cache.set(key, result)
+        return result
+
+
+class RedisCachedCount(CountStrategy):
+    """
+    Cache counts in redis, so they are shared between processes. Keyed in
+    the same way as :class:`CachedCount`.
+
+    :param redis: A ``redis.StrictRedis`` (or compatible) client.
+    :param counter: (optional) The strategy to use on a cache miss.
+                    (Default: :class:`ExactCount`)
+    :param ttl: (optional) Seconds a count is cached for. (Default: ``60``)
+    :param key_prefix: (optional) Prefix for the redis keys.
+    """
+
+    def __init__(self, redis, counter=None, ttl=60, key_prefix='twopi:count:'):
+        self.redis = redis
+        self.counter = counter or ExactCount()
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def count(self, query):
+        key = self.key_prefix + query_cache_key(query)
+        cached = self.redis.get(key)
+        if cached is not None:
+            total, estimated = json.loads(cached.decode('UTF-8'))
+            return total, estimated
+
+        total, estimated = self.counter.count(query)
+        self.redis.setex(key, self.ttl, json.dumps([total, estimated]))
+        return total, estimated
+
+
+def _unfiltered_table(query):
+    from sqlalchemy import Table
+
+    statement = query.statement
+    get_final_froms = getattr(statement, 'get_final_froms', None)
+    if get_final_froms is not None:
+        # SQLAlchemy >= 1.4.23, which deprecates Select.froms.
+        froms = get_final_froms()
+    else:
+        froms = statement.froms
+    if len(froms) != 1 or not isinstance(froms[0], Table):
+        return None
+
+    whereclause = getattr(statement, 'whereclause', None)
+    if whereclause is None:
+        whereclause = statement._whereclause
+
+    having = getattr(statement, '_having_criteria', None)
+    if having is None:
+        # SQLAlchemy < 1.4 has a single clause, or None.
+        having = () if statement._having is None else (statement._having,)
+
+    if whereclause is not None or having \
+            or statement._group_by_clause.clauses or statement._distinct \
+            or statement._limit_clause is not None \
+            or statement._offset_clause is not None:
+        return None
+
+    return froms[0]
+
+
+class PostgresEstimatedCount(CountStrategy):
+    """
+    Estimate the count of unfiltered queries over a single table from
+    Postgres' planner statistics (``pg_class.reltuples``) rather than
+    scanning the table. Filtered queries, and tables whose statistics
+    are missing or small, are counted using ``counter``.
+
+    Estimated counts are flagged with ``totalItemsEstimated`` in the
+    paginated response.
+
+    :param counter: (optional) The strategy used when an estimate is not
+                    possible. (Default: :class:`ExactCount`)
+    :param min_estimate: (optional) Estimates below this are counted exactly
+                         instead. (Default: ``10000``)
+    """
+
+    def __init__(self, counter=None, min_estimate=10000):
+        self.counter = counter or ExactCount()
+        self.min_estimate = min_estimate
+
+    def count(self, query):
+        from sqlalchemy import text
+
+        table = _unfiltered_table(query)
+        if table is not None:
+            preparer = _query_bind(query).dialect.identifier_preparer
+            estimate = query.session.execute(
+                text('SELECT reltuples::bigint FROM pg_class '
+                     'WHERE oid = to_regclass(:name)'),
+                {'name': preparer.format_table(table)}
+            ).scalar()
+
+            if estimate is not None and estimate >= self.min_estimate:
+                return estimate, True
+
+        return self.counter.count(query)
+
+
+_exact_count = ExactCount()
+
+COUNT_WORKERS = 8
+
+_count_pool = LazyThreadPool()
+
+
+def _count_executor():
+    return _count_pool.get(COUNT_WORKERS)
+
+
+def _in_transaction(session):
+    if session.new or session.dirty or session.deleted:
+        return True
+
+    in_transaction = getattr(session, 'in_transaction', None)
+    if in_transaction is not None:
+        return in_transaction()
+
+    transaction = session.transaction
+    return transaction is not None and bool(transaction._connections)
+
+
+def _has_spare_connection(engine):
+    from sqlalchemy.pool import NullPool, QueuePool
+
+    pool = engine.pool
+    if isinstance(pool, NullPool):
+        return True
+
+    if isinstance(pool, QueuePool):
+        max_overflow = getattr(pool, '_max_overflow', 0)
+        return max_overflow < 0 or \
+            pool.checkedout() + 1 < pool.size() + max_overflow
+
+    return False
+
+
+def _count_in_session(engine, query, counter):
+    from sqlalchemy.orm import Session
+
+    session = Session(bind=engine)
+    try:
+        return counter.count(query.with_session(session))
+    finally:
+        session.close()
+
+
+def _count_concurrently(query, counter, executor):
+    """
+    Start counting ``query`` on its own session in ``executor``. Returns
+    ``None`` if the count can't safely run on a separate connection.
+    """
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.exc import UnboundExecutionError
+
+    session = query.session
+    try:
+        engine = _query_bind(query)
+    except UnboundExecutionError:
+        return None
+
+    # A session bound to a connection has no pool to borrow from.
+    if not isinstance(engine, Engine) or _in_transaction(session) \
+            or not _has_spare_connection(engine):
+        return None
+
+    if executor is True:
+        executor = _count_executor()
+
+    return executor.submit(_count_in_session, engine, query, counter)
+
+
+def _row_values(row, order_by):
+    return [getattr(row, column.key) for column in order_by]
+
+
+def _keyset_page(basequery, order_by, cursor, limit, descending):
+    from sqlalchemy import tuple_
+
+    backwards = False
+    query = basequery.order_by(None)
+
+    if cursor is not None:
+        try:
+            values, backwards = decode_cursor(cursor)
+            if len(values) != len(order_by):
+                raise ValidationError({'cursor': ['Invalid cursor.']})
+        except ValidationError as error:
+            # Respond as the parser does to an invalid offset or limit.
+            parser.handle_error(error, request, None, error_status_code=None,
+                                error_headers=None)
+
+        keys = tuple_(*order_by)
+        bound = tuple_(*values)
+        if backwards != descending:
+            query = query.filter(keys < bound)
+        else:
+            query = query.filter(keys > bound)
+
+    if backwards != descending:
+        query = query.order_by(*[column.desc() for column in order_by])
+    else:
+        query = query.order_by(*order_by)
+
+    # Fetch a single extra row to find out if there is another page in the
+    # direction we are travelling, without having to count.
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = None
+    prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(_row_values(rows[-1], order_by))
+        if (has_more and backwards) or (cursor is not None and not backwards):
+            prev_cursor = encode_cursor(_row_values(rows[0], order_by),
+                                        backwards=True)
+
+    return rows, next_cursor, prev_cursor
+
+
+_schema_lock = threading.Lock()
+_schema_classes = {}
+_schema_instances = threading.local()
+
+
+def _build_pagination_schema(schema_type, only):
+    class _Pagination(Schema):
+        offset = fields.Integer()
+        nextCursor = fields.String()
+        prevCursor = fields.String()
+        limit = fields.Integer()
+        totalItems = fields.Integer()
+        totalItemsEstimated = fields.Boolean()
+        items = fields.Nested(schema_type, many=True, only=only)
+
+    return _Pagination
+
+
+def pagination_schema(schema_type, only=None):
+    """
+    Return the envelope schema used by :func:`paginated` to dump a page of
+    ``schema_type`` items.
+
+    The schema class is built once per ``(schema_type, only)`` and reused
+    across requests. Marshmallow schema instances hold state while dumping,
+    so each thread gets its own instance of the class.
+
+    :param schema_type: The ``Marshmallow`` schema to dump items with
+    :param only: (Optional) A list of item fields to dump
+    :returns: An instance of the envelope schema.
+    """
+    key = (schema_type, tuple(only) if only is not None else None)
+
+    instances = getattr(_schema_instances, 'cache', None)
+    if instances is None:
+        instances = _schema_instances.cache = {}
+
+    schema = instances.get(key)
+    if schema is None:
+        with _schema_lock:
+            schema_cls = _schema_classes.get(key)
+            if schema_cls is None:
+                schema_cls = _build_pagination_schema(schema_type, only)
+                _schema_classes[key] = schema_cls
+        schema = instances[key] = schema_cls()
+
+    return schema
+
+
+def paginated(basequery, schema_type, offset=None, limit=None, order_by=None,
+              cursor=None, descending=False, count_strategy=None, only=None,
+              concurrent=False):
     """
     Paginate a sqlalchemy query
-    
+
+    By default pages are selected using ``LIMIT``/``OFFSET``. If ``order_by``
+    is provided, keyset (seek) pagination is used instead: the query is
+    ordered by the given columns and each page is selected with a
+    ``WHERE (col1, col2) > (...)`` predicate built from an opaque cursor, so
+    every page costs the same to fetch no matter how deep it is. The response
+    then contains ``nextCursor`` and ``prevCursor`` instead of ``offset``.
+
     :param basequery: The base query to be iterated upon
     :param schema_type: The ``Marshmallow`` schema to dump data with
-    :param offset: (Optional) The offset into the data. If omitted it will 
+    :param offset: (Optional) The offset into the data. If omitted it will
                   be read from the query string in the ``?offset=`` argument. If
                   not query string, defaults to 0.
-    :param limit: (Optional) The maximum results per page. If omitted it will 
+    :param limit: (Optional) The maximum results per page. If omitted it will
                   be read from the query string in the ``?limit=`` argument. If
                   not query string, defaults to 20.
-    
+    :param order_by: (Optional) A list of columns to use for keyset
+                     pagination. Together they must uniquely identify a row,
+                     e.g. ``[User.created_at, User.id]``.
+    :param cursor: (Optional) The cursor of the page to fetch when using
+                   keyset pagination. If omitted it will be read from the
+                   query string in the ``?cursor=`` argument. If not in the
+                   query string, the first page is returned. An invalid
+                   cursor aborts with a ``422``, like an invalid offset or
+                   limit.
+    :param descending: (Optional) ``bool``: Order the keyset columns in
+                       descending order. (Default: ``False``)
+    :param count_strategy: (Optional) A :class:`CountStrategy` used to compute
+                           ``totalItems``. If the strategy returns an
+                           estimate, ``totalItemsEstimated`` is set in the
+                           response. (Default: :class:`ExactCount`)
+    :param only: (Optional) A list of item fields to dump. See
+                 :func:`pagination_schema`.
+    :param concurrent: (Optional) If ``True``, ``totalItems`` is counted on a
+                       separate pooled connection in a shared thread pool
+                       while the page is fetched, so the response takes as
+                       long as the slower of the two queries rather than
+                       their sum. A ``concurrent.futures.Executor`` may be
+                       passed instead of ``True`` to run the count in.
+                       Falls back to counting after the page is fetched if
+                       the query's session has already begun a transaction
+                       (the other connection couldn't see its changes) or
+                       its pool has no spare connection.
+                       (Default: ``False``)
+
     :returns: The page's data in a namedtuple form ``(data=, errors=)``
     """
 
-    if offset is None or limit is None:
-        args = parser.parse(pagination_args, request)
+    keyset = order_by is not None
+
+    if limit is None or (cursor is None if keyset else offset is None):
+        args = parser.parse(pagination_args, request, **_parse_kwargs)
         if offset is None:
             offset = args['offset']
 
         if limit is None:
             limit = args['limit']
 
-    data = {
-        'offset': offset,
-        'limit': limit,
-        'items': basequery.limit(limit).offset(offset),
-        'totalItems': basequery.count()
-    }
+        if cursor is None:
+            cursor = args['cursor']
 
-    class _Pagination(Schema):
-        offset = fields.Integer()
-        limit = fields.Integer()
-        totalItems = fields.Integer()
-        items = fields.Nested(schema_type, many=True)
+    counter = count_strategy or _exact_count
+    count_future = None
+    if concurrent:
+        count_future = _count_concurrently(basequery, counter, concurrent)
+
+    if keyset:
+        items, next_cursor, prev_cursor = _keyset_page(
+            basequery, order_by, cursor, limit, descending)
+        data = {
+            'nextCursor': next_cursor,
+            'prevCursor': prev_cursor,
+            'limit': limit,
+            'items': items,
+        }
+    else:
+        items = basequery.limit(limit).offset(offset)
+        if count_future is not None:
+            # Fetch the page now, while the count is still running.
+            items = items.all()
+
+        data = {
+            'offset': offset,
+            'limit': limit,
+            'items': items,
+        }
+
+    if count_future is not None:
+        total, estimated = count_future.result()
+    else:
+        total, estimated = counter.count(basequery)
+    data['totalItems'] = total
+    if estimated:
+        data['totalItemsEstimated'] = True
+
+    return pagination_schema(schema_type, only).dump(data)
+
+
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def _dump(schema, obj):
+    result = schema.dump(obj)
+    if MARSHMALLOW_VERSION_INFO[0] < 3:
+        return result.data
+    return result
+
+
+def _dump_batches(basequery, schema, batch_size):
+    batch = []
+    for row in basequery.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield _dump(schema, batch)
+            batch = []
+
+    if batch:
+        yield _dump(schema, batch)
+
+
+def _ndjson_chunks(batches):
+    for items in batches:
+        yield ''.join(json.dumps(item) + '\n' for item in items)
+
+
+def _json_array_chunks(batches):
+    # Send the opening bracket straight away, before the query has run.
+    yield '['
+    separator = ''
+    for items in batches:
+        yield separator + ','.join(json.dumps(item) for item in items)
+        separator = ','
+    yield ']'
+
+
+def streamed(basequery, schema_type, format='ndjson', batch_size=500,
+             only=None):
+    """
+    Stream every row of a sqlalchemy query as a chunked response, for
+    exports which are too large to paginate through.
+
+    Rows are fetched with ``yield_per(batch_size)`` and dumped with
+    ``schema_type`` one batch at a time, so memory use stays constant
+    regardless of the size of the result, and the response starts sending
+    before the query has finished.
+
+    .. code-block:: python
+
+        @app.route('/users/export')
+        def export_users():
+            return streamed(User.query.order_by(User.id), UserSchema)
+
+    :param basequery: The query to stream
+    :param schema_type: The ``Marshmallow`` schema to dump rows with
+    :param format: (Optional) ``'ndjson'`` to write one JSON document per
+                   line, or ``'json'`` to write a single JSON array.
+                   (Default: ``'ndjson'``)
+    :param batch_size: (Optional) The number of rows to fetch and dump at
+                       a time. (Default: ``500``)
+    :param only: (Optional) A list of fields to dump.
+    :returns: A streaming ``flask.Response``.
+    """
+    schema = schema_type(many=True, only=only)
+    batches = _dump_batches(basequery, schema, batch_size)
+
+    if format == 'ndjson':
+        chunks = _ndjson_chunks(batches)
+    elif format == 'json':
+        chunks = _json_array_chunks(batches)
+    else:
+        raise ValueError("Unknown stream format {}".format(format))
 
-    return _Pagination().dump(data)
+    return Response(stream_with_context(chunks),
+                    mimetype=STREAM_MIMETYPES[format])
 
 
-__all__ = ['paginated']
+__all__ = ['paginated', 'streamed', 'pagination_schema', 'encode_cursor',
+           'decode_cursor', 'CountStrategy',
+           'ExactCount', 'CachedCount', 'RedisCachedCount',
+           'PostgresEstimatedCount', 'query_cache_key']
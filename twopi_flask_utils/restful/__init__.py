@@ -1,4 +1,12 @@
-from flask import jsonify, request
+from flask import Response, current_app, request
+from .serializers import get_serializer, json_response
+from .conditional import make_conditional
+from .compression import get_compressor
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 def format_errors(*errors):
     return {
@@ -49,10 +57,25 @@ def output_json(data, code, headers=None):
         }
 
 
-    All data is returned using flask's jsonify method. This means you can 
-    use simplejson to return decimal objects from your flask restful resources.
+    All data is encoded with the serializer from
+    :func:`~twopi_flask_utils.restful.serializers.get_serializer`. By default
+    flask's json module is used, which means you can use simplejson to return
+    decimal objects from your flask restful resources.
+
+    Successful ``GET`` responses are given a strong ETag computed from the
+    body (unless the resource returned its own ``ETag`` header), and a
+    ``304`` is returned if it matches ``If-None-Match``. See
+    :mod:`twopi_flask_utils.restful.conditional`.
+
+    Responses are compressed if a ``RESPONSE_COMPRESSOR`` is configured. See
+    :mod:`twopi_flask_utils.restful.compression`.
+
+    On Python 3, a resource may return a body which is already encoded as
+    JSON as ``bytes``, ``bytearray`` or a ``memoryview`` (e.g. a cached
+    response). It is sent as is, without being decoded and re-encoded.
     """
 
+    encoded = None
     if type(data) is str:
         # Handle view returning a string.
         message = data
@@ -61,17 +84,27 @@ def output_json(data, code, headers=None):
         else:
             data = {'message': message}
 
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        # Already encoded. (On Python 2, bytes are handled as a string above.)
+        # WSGI needs bytes, so a memoryview is copied once, but never decoded.
+        encoded = data.tobytes() if isinstance(data, memoryview) else data
+
     elif code >= 400 and type(data) is dict and 'message' in data:
         # Flask-Restful returns non-200 error messages to the user.
         # Let's show them.
         data = format_errors(data.get('message'))
 
-    resp = jsonify(data)
+    if encoded is not None:
+        resp = Response(encoded, status=code or None, headers=headers,
+                        mimetype=get_serializer().mimetype)
+    else:
+        resp = json_response(data, code or None, headers)
 
-    if code:
-        resp.status_code = code
+    resp = make_conditional(resp)
 
-    resp.headers.extend(headers)
+    compressor = get_compressor()
+    if compressor is not None:
+        resp = compressor.compress_response(resp)
     return resp
 
 
@@ -96,20 +129,239 @@ class ExpectedJSONException(Exception):
 
 
         """
-        return jsonify(
-            format_error('Resource expected a JSON payload to be provided.')
-        ), 400
+        return json_response(
+            format_error('Resource expected a JSON payload to be provided.'), 400)
+
+
+class PayloadTooLargeException(Exception):
+    """
+    Thrown when a JSON payload is larger than the maximum size allowed by
+    :func:`get_and_expect_json` or :func:`iter_json_items`.
+    """
+
+    @classmethod
+    def handle(cls, exc):
+        """
+        A handler for this type of exception, which responds with a ``413``.
+
+        Usage:
+
+        .. code-block:: python
+
+            app.errorhandler(PayloadTooLargeException)(PayloadTooLargeException.handle)
+
+        """
+        return json_response(
+            format_error('The payload provided to the resource is too large.'), 413)
+
 
+_missing = object()
 
-def get_and_expect_json():
+
+def get_request_json(silent=False):
+    """
+    Decode the JSON body of the current request with the current serializer.
+    The result is cached on the request, so
+    :class:`~twopi_flask_utils.webargs.BetterFlaskParser`,
+    :func:`get_and_expect_json`, ``request.get_json()`` and the view all
+    share a single decode.
+
+    :param silent: (optional, ``bool``) Return ``None`` rather than raising a
+                   ``BadRequest`` if the body isn't valid JSON.
+    :returns: The decoded data, or ``None`` if the request isn't JSON.
+    """
+    data, error = getattr(request, '_twopi_json', (_missing, None))
+    if data is _missing:
+        data = None
+        if request.is_json:
+            try:
+                data = get_serializer().loads(request.get_data(cache=True))
+            except ValueError as exc:
+                error = exc
+
+        request._twopi_json = (data, error)
+        if error is None and hasattr(request, '_cached_json'):
+            # Flask's own cache for get_json().
+            request._cached_json = (data, data)
+
+    if error is not None and not silent:
+        return request.on_json_loading_failed(error)
+    return data
+
+
+class _BoundedStream(object):
+    # Raises PayloadTooLargeException once more than max_size bytes are read.
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.read_size = 0
+
+    def read(self, size=-1):
+        if size == 0:
+            # ijson probes the stream with read(0), which werkzeug >= 2.3's
+            # LimitedStream takes for a disconnected client.
+            return b''
+
+        data = self.stream.read(size)
+        self.read_size += len(data)
+        if self.max_size is not None and self.read_size > self.max_size:
+            raise PayloadTooLargeException()
+        return data
+
+
+def _check_json_size(max_size):
+    if max_size is None:
+        max_size = current_app.config.get('MAX_JSON_SIZE')
+
+    # Reject what we can before reading anything.
+    if max_size is not None and request.content_length is not None \
+            and request.content_length > max_size:
+        raise PayloadTooLargeException()
+    return max_size
+
+
+def get_and_expect_json(max_size=None):
     """
     Returns the ``flask.request.get_json()`, however if no JSON data was decoded,
     will raise a :class:`ExpectedJSONException`
+
+    The body is decoded with :func:`get_request_json`.
+
+    :param max_size: (optional) The largest body, in bytes, to accept.
+                     Larger bodies raise a :class:`PayloadTooLargeException`,
+                     without being read if their ``Content-Length`` is too
+                     large. (Default: the ``MAX_JSON_SIZE`` config key, or
+                     unlimited)
     """
 
-    data = request.get_json()
+    max_size = _check_json_size(max_size)
+    if max_size is not None and request.content_length is None \
+            and request.is_json and not hasattr(request, '_twopi_json'):
+        # A chunked body of unknown length. Read no more than max_size + 1
+        # bytes of it, and have get_data() reuse them.
+        request._cached_data = _BoundedStream(request.stream, max_size).read(max_size + 1)
+
+    data = get_request_json()
     if data is None:
         raise ExpectedJSONException()
     
     return data
 
+
+def _select_items(data, path):
+    # Mirror ijson's prefixes for an already decoded document.
+    if not path:
+        yield data
+        return
+
+    key, rest = path[0], path[1:]
+    if key == 'item':
+        children = data if isinstance(data, list) else []
+    else:
+        children = [data[key]] if isinstance(data, dict) and key in data else []
+
+    for child in children:
+        for item in _select_items(child, rest):
+            yield item
+
+
+def _selected_items(data, path):
+    # As _select_items, but the elements must be in an array.
+    if path and path[-1] == 'item':
+        parents = list(_select_items(data, path[:-1]))
+        if not parents or not isinstance(parents[0], list):
+            raise ExpectedJSONException()
+    return _select_items(data, path)
+
+
+def _array_found(events, parent):
+    # True once the first value at the parent prefix is found to be an
+    # array, or None if it hasn't been parsed yet.
+    for event_prefix, event, value in events:
+        if event_prefix == parent:
+            if event != 'start_array':
+                raise ExpectedJSONException()
+            return True
+    return None
+
+
+class _ArrayCheckedStream(object):
+    # Raises ExpectedJSONException unless the first value at the parent
+    # prefix is an array. The body is only parsed for the check until that
+    # value is found, which is normally in the first read.
+
+    def __init__(self, stream, parent):
+        self.stream = stream
+        self.parent = parent
+        self.events = ijson.sendable_list()
+        self.parser = ijson.parse_coro(self.events)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self.parser is None or size == 0:
+            return data
+
+        if data:
+            self.parser.send(data)
+        else:
+            self.parser.close()
+
+        found = _array_found(self.events, self.parent)
+        del self.events[:]
+        if found:
+            self.parser = None
+        elif not data:
+            raise ExpectedJSONException()
+        return data
+
+
+def _iter_ijson(stream, prefix):
+    path = prefix.split('.') if prefix else []
+    if path and path[-1] == 'item':
+        # Elements with a prefix ending in "item" must be in an array.
+        stream = _ArrayCheckedStream(stream, '.'.join(path[:-1]))
+
+    try:
+        for item in ijson.items(stream, prefix, use_float=True):
+            yield item
+    except ijson.JSONError as exc:
+        request.on_json_loading_failed(exc)
+
+
+def iter_json_items(prefix='item', max_size=None):
+    """
+    Iterate over the elements of a JSON array in the request body as they
+    are parsed, for bulk endpoints. With `ijson <https://pypi.org/project/ijson/>`_
+    installed, the body is read and parsed incrementally, so memory use
+    stays bounded however large the payload is. Otherwise the body is
+    decoded in one go.
+
+    .. code-block:: python
+
+        for item in iter_json_items('items.item', max_size=50 * 1024 * 1024):
+            import_item(item)
+
+    :param prefix: (optional) The ``ijson`` prefix of the elements to yield,
+                   e.g. ``item`` for the elements of a top level array, or
+                   ``items.item`` for the elements of an ``items`` array.
+                   (Default: ``item``)
+    :param max_size: (optional) The largest body, in bytes, to accept.
+                     See :func:`get_and_expect_json`.
+    :raises ExpectedJSONException: If the request isn't JSON, or (for a
+                                   prefix ending in ``item``) the elements
+                                   aren't in an array.
+    :raises PayloadTooLargeException: If the body is too large. This may be
+                                      raised during iteration, once the
+                                      limit has been read.
+    """
+    max_size = _check_json_size(max_size)
+    if not request.is_json:
+        raise ExpectedJSONException()
+
+    if ijson is None or hasattr(request, '_twopi_json'):
+        return _selected_items(get_and_expect_json(max_size),
+                               prefix.split('.') if prefix else [])
+
+    return _iter_ijson(_BoundedStream(request.stream, max_size), prefix)
+
@@ -0,0 +1,433 @@
+"""
+Caching of encoded ``GET`` responses.
+
+A :class:`ResponseCache` stores the encoded body of a view's response, so a
+hit skips both the view and encoding its response. Entries are keyed on the
+endpoint, its URL arguments and the normalised query string, and optionally
+the user the response is for (see :meth:`ResponseCache.cached`).
+
+.. code-block:: python
+
+    cache = ResponseCache(RedisCacheBackend(redis))
+
+    class ItemList(Resource):
+        method_decorators = [cache.cached(ttl=30, stale_ttl=300, tags=['items'])]
+
+        def get(self):
+            ...
+
+    # After changing an item:
+    cache.invalidate_tags('items')
+
+Only one worker computes a missing entry: the others wait for it to be
+stored (for up to ``lock_timeout`` seconds) rather than all running the view
+at once. Once an entry is older than ``ttl`` it is stale, but is still
+served for up to ``stale_ttl`` more seconds while a single request
+recomputes it.
+
+Only successful responses of JSON data (a dict or list, as encoded by
+:func:`~twopi_flask_utils.restful.output_json`) or a non-streamed
+``Response`` are cached, and only if they don't set a cookie. A cached
+entry is returned as a tuple of the encoded ``bytes``, status and headers,
+which ``output_json`` sends as is. Every header is stored except
+``Content-Length`` and hop-by-hop headers.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+from flask import Response, g, request
+from werkzeug.datastructures import Headers
+from werkzeug.http import is_hop_by_hop_header
+from twopi_flask_utils.caching import LRUCache
+from .conditional import _unpack_rv, body_etag
+from .serializers import json_response
+
+
+class CacheEntry(object):
+    """
+    A cached response.
+
+    :param body: ``bytes``: The encoded body.
+    :param status: The status code.
+    :param headers: A list of ``(name, value)`` header tuples.
+    :param fresh_until: The time at which the entry becomes stale.
+    :param tag_versions: The versions of the entry's tags when it was
+                         computed.
+    """
+
+    __slots__ = ('body', 'status', 'headers', 'fresh_until', 'tag_versions')
+
+    def __init__(self, body, status, headers, fresh_until, tag_versions=()):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.fresh_until = fresh_until
+        self.tag_versions = tuple(tag_versions)
+
+    def encode(self):
+        """
+        :returns: ``bytes``: The entry, for a remote backend.
+        """
+        meta = json.dumps([self.status, self.headers, self.fresh_until,
+                           self.tag_versions], separators=(',', ':'))
+        return meta.encode('UTF-8') + b'\n' + self.body
+
+    @classmethod
+    def decode(Cls, data):
+        """Load an entry from :meth:`encode`."""
+        meta, _, body = data.partition(b'\n')
+        status, headers, fresh_until, tag_versions = json.loads(meta.decode('UTF-8'))
+        return Cls(body, status, [tuple(header) for header in headers],
+                   fresh_until, tag_versions)
+
+    def to_response(self):
+        """
+        :returns: A ``(body, status, headers)`` tuple to return from a view.
+        """
+        return self.body, self.status, Headers(self.headers)
+
+
+class CacheBackend(object):
+    """
+    Stores cached responses. Subclasses implement every method.
+    """
+
+    def get(self, key):
+        """
+        :returns: The :class:`CacheEntry` for ``key``, or ``None``.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, entry, ttl):
+        """Store ``entry`` under ``key`` for ``ttl`` seconds."""
+        raise NotImplementedError()
+
+    def tag_versions(self, tags):
+        """
+        :returns: A list of the current version of each of ``tags``.
+        """
+        raise NotImplementedError()
+
+    def invalidate_tags(self, tags):
+        """Bump the version of each of ``tags``."""
+        raise NotImplementedError()
+
+    def lock(self, key, timeout):
+        """
+        Try to acquire the lock for ``key``, which is released after
+        ``timeout`` seconds if it isn't released with :meth:`unlock`.
+
+        :returns: ``True`` if the lock was acquired.
+        """
+        raise NotImplementedError()
+
+    def unlock(self, key):
+        """Release the lock for ``key``."""
+        raise NotImplementedError()
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    Caches responses in-process, in an :class:`~twopi_flask_utils.caching.LRUCache`.
+
+    :param maxsize: (optional) The maximum number of responses to cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.cache = LRUCache(maxsize=maxsize)
+        self._tags = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry, ttl):
+        self.cache.set(key, entry, ttl=ttl)
+
+    def tag_versions(self, tags):
+        return [self._tags.get(tag, 0) for tag in tags]
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+
+    def lock(self, key, timeout):
+        now = time.time()
+        with self._lock:
+            expires = self._locks.get(key)
+            if expires is not None and expires > now:
+                return False
+            self._locks[key] = now + timeout
+            return True
+
+    def unlock(self, key):
+        with self._lock:
+            self._locks.pop(key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Caches responses in redis, shared between processes.
+
+    :param redis: A ``redis.StrictRedis`` (or compatible) client.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def get(self, key):
+        data = self.redis.get(key)
+        return CacheEntry.decode(data) if data is not None else None
+
+    def set(self, key, entry, ttl):
+        self.redis.setex(key, max(1, int(ttl)), entry.encode())
+
+    def tag_versions(self, tags):
+        return [int(version or 0)
+                for version in self.redis.mget(tags)]
+
+    def invalidate_tags(self, tags):
+        pipe = self.redis.pipeline()
+        for tag in tags:
+            pipe.incr(tag)
+        pipe.execute()
+
+    def lock(self, key, timeout):
+        return bool(self.redis.set(key + ':lock', b'1', nx=True,
+                                   px=int(timeout * 1000)))
+
+    def unlock(self, key):
+        self.redis.delete(key + ':lock')
+
+
+class MemcachedCacheBackend(CacheBackend):
+    """
+    Caches responses in memcached, shared between processes.
+
+    :param client: A ``pymemcache`` client (or compatible), without a
+                   serializer.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        data = self.client.get(key)
+        return CacheEntry.decode(data) if data is not None else None
+
+    def set(self, key, entry, ttl):
+        self.client.set(key, entry.encode(), expire=max(1, int(ttl)))
+
+    def tag_versions(self, tags):
+        versions = self.client.get_many(tags)
+        return [int(versions.get(tag) or 0) for tag in tags]
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            if self.client.incr(tag, 1, noreply=False) is None and \
+                    not self.client.add(tag, b'1', noreply=False):
+                # Created by someone else in the meantime.
+                self.client.incr(tag, 1, noreply=False)
+
+    def lock(self, key, timeout):
+        return self.client.add(key + ':lock', b'1', expire=max(1, int(timeout)),
+                               noreply=False)
+
+    def unlock(self, key):
+        self.client.delete(key + ':lock', noreply=False)
+
+
+def _encode_response(rv):
+    # Encode a view's return value for the cache, or return None if it can't
+    # be cached.
+    rv, status, headers = _unpack_rv(rv)
+    if isinstance(rv, Response):
+        resp = rv
+        if resp.is_streamed or resp.direct_passthrough:
+            return None
+    elif isinstance(rv, (dict, list)):
+        resp = json_response(rv, status, headers)
+    else:
+        return None
+
+    if resp.status_code != 200 or 'Set-Cookie' in resp.headers:
+        return None
+
+    body = resp.get_data()
+    if 'ETag' not in resp.headers:
+        # Computed once here rather than on every hit.
+        resp.set_etag(body_etag(body))
+
+    return body, resp.status_code, [
+        (name, value) for name, value in resp.headers
+        if name.lower() != 'content-length' and not is_hop_by_hop_header(name)]
+
+
+def token_subject(*args, **kwargs):
+    """
+    The ``vary`` of :meth:`ResponseCache.cached` when ``vary_on_token`` is
+    used: the subject of ``g.token``. Requests without a token share their
+    own entries, and tokens without a subject aren't cached at all.
+    """
+    token = g.get('token')
+    if token is None:
+        return ('anonymous',)
+
+    if token.subject is None:
+        return None
+    return ('subject', token.subject)
+
+
+class ResponseCache(object):
+    """
+    Caches the encoded responses of views.
+
+    :param backend: (optional) The :class:`CacheBackend`.
+                    (Default: an :class:`LRUCacheBackend`)
+    :param key_prefix: (optional) Prefix for the cache keys.
+    :param lock_timeout: (optional) The most seconds a request computing an
+                         entry holds the lock for, and so that others wait
+                         for it. (Default: ``10``)
+    :param poll_interval: (optional) Seconds between checks for the entry
+                          while waiting. (Default: ``0.05``)
+    """
+
+    def __init__(self, backend=None, key_prefix='twopi:response:', lock_timeout=10,
+                 poll_interval=0.05):
+        self.backend = backend or LRUCacheBackend()
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    def cache_key(self, view_args, vary=None):
+        """
+        :param view_args: The view's URL arguments.
+        :param vary: (optional) A value to vary the entry on, as returned by
+                     the ``vary`` callable of :meth:`cached`.
+        :returns: The cache key for the current request.
+        """
+        parts = [request.endpoint, sorted(view_args.items()),
+                 sorted(request.args.items(multi=True))]
+        if vary is not None:
+            parts.append(vary)
+
+        digest = hashlib.sha1(repr(parts).encode('UTF-8')).hexdigest()
+        return '{}{}:{}'.format(self.key_prefix, request.endpoint, digest)
+
+    def _tag_key(self, tag):
+        return '{}tag:{}'.format(self.key_prefix, tag)
+
+    def invalidate_tags(self, *tags):
+        """
+        Invalidate every entry cached with any of ``tags``.
+        """
+        self.backend.invalidate_tags([self._tag_key(tag) for tag in tags])
+
+    def _get(self, key, tags):
+        entry = self.backend.get(key)
+        if entry is None or not tags:
+            return entry
+
+        if list(entry.tag_versions) != self.backend.tag_versions(tags):
+            # A tag has been invalidated since the entry was computed.
+            return None
+        return entry
+
+    def _compute(self, key, tags, ttl, stale_ttl, f, args, kwargs):
+        # Read the tag versions first, so an invalidation while the view
+        # runs invalidates the new entry too.
+        tag_versions = self.backend.tag_versions(tags) if tags else ()
+        rv = f(*args, **kwargs)
+
+        encoded = _encode_response(rv)
+        if encoded is None:
+            return rv
+
+        body, status, headers = encoded
+        entry = CacheEntry(body, status, headers, time.time() + ttl, tag_versions)
+        self.backend.set(key, entry, ttl + stale_ttl)
+        return entry.to_response()
+
+    def _wait(self, key, tags):
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self._get(key, tags)
+            if entry is not None:
+                return entry
+        return None
+
+    def cached(self, ttl=60, stale_ttl=0, tags=None, vary_on_token=False, vary=None):
+        """
+        A decorator to cache the responses of a view, or Flask-Restful
+        resource method. Only ``GET`` and ``HEAD`` requests are cached.
+
+        :param ttl: (optional) Seconds an entry is fresh for. (Default: ``60``)
+        :param stale_ttl: (optional) Seconds a stale entry is served for
+                          while it is recomputed. (Default: ``0``)
+        :param tags: (optional) A list of tags to cache entries with, for
+                     :meth:`invalidate_tags`, or a callable returning them
+                     which is called with the view's arguments.
+        :param vary_on_token: (optional, ``bool``) Cache entries per
+                              ``g.token.subject``, with :func:`token_subject`.
+                              (Default: ``False``)
+        :param vary: (optional) A callable which is called with the view's
+                     arguments and returns a value identifying who the
+                     response is for, e.g. ``lambda **kwargs:
+                     g.token.user_id``. Entries are cached per value. If it
+                     returns ``None``, the response isn't cached.
+
+        ``vary`` or ``vary_on_token`` must be used for any view whose
+        response depends on the user.
+        """
+        if vary is None and vary_on_token:
+            vary = token_subject
+
+        def wrapper(f):
+            @wraps(f)
+            def wrapped(*args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return f(*args, **kwargs)
+
+                vary_value = None
+                if vary is not None:
+                    vary_value = vary(*args, **kwargs)
+                    if vary_value is None:
+                        # Can't tell who the response is for, so don't share it.
+                        return f(*args, **kwargs)
+
+                key = self.cache_key(kwargs, vary_value)
+                tag_names = tags(*args, **kwargs) if callable(tags) else tags
+                tag_keys = [self._tag_key(tag) for tag in tag_names or ()]
+
+                entry = self._get(key, tag_keys)
+                if entry is not None and entry.fresh_until > time.time():
+                    return entry.to_response()
+
+                if not self.backend.lock(key, self.lock_timeout):
+                    if entry is not None:
+                        # Someone else is revalidating this entry.
+                        return entry.to_response()
+
+                    entry = self._wait(key, tag_keys)
+                    if entry is not None:
+                        return entry.to_response()
+
+                    # Gave up waiting.
+                    return self._compute(key, tag_keys, ttl, stale_ttl, f, args, kwargs)
+
+                try:
+                    return self._compute(key, tag_keys, ttl, stale_ttl, f, args, kwargs)
+                finally:
+                    self.backend.unlock(key)
+
+            return wrapped
+        return wrapper
+
+
+__all__ = ['ResponseCache', 'token_subject', 'CacheEntry', 'CacheBackend', 'LRUCacheBackend',
+           'RedisCacheBackend', 'MemcachedCacheBackend']
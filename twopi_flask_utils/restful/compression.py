@@ -0,0 +1,267 @@
+"""
+Compression of responses, negotiated with the request's ``Accept-Encoding``.
+
+``gzip`` is always available. ``br`` requires `brotli
+<https://pypi.org/project/Brotli/>`_ and ``zstd`` requires `zstandard
+<https://pypi.org/project/zstandard/>`_ (``pip install
+twopi-flask-utils[compression]``), and are preferred over ``gzip`` when
+installed and accepted by the client.
+
+Set the ``RESPONSE_COMPRESSOR`` config key to compress the responses of
+:func:`~twopi_flask_utils.restful.output_json`, or call
+:meth:`Compressor.init_app` to compress every response of the app:
+
+.. code-block:: python
+
+    app.config['RESPONSE_COMPRESSOR'] = Compressor(min_size=1024)
+
+    # Or
+    Compressor(min_size=1024).init_app(app)
+"""
+import zlib
+from flask import current_app, request
+from twopi_flask_utils._executors import LazyThreadPool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#: The number of threads used to compress large bodies, when enabled.
+COMPRESSION_WORKERS = 4
+
+#: Mimetypes which are compressed, along with every ``text/*`` type.
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+])
+
+_compression_pool = LazyThreadPool()
+
+
+def _compression_executor():
+    return _compression_pool.get(COMPRESSION_WORKERS)
+
+
+class GzipEncoder(object):
+    """``Content-Encoding: gzip``, with ``zlib``."""
+    name = 'gzip'
+    default_level = 6
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    def _compressobj(self):
+        # wbits of 16 + 15 writes a gzip header and trailer.
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        compressor = self._compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self, chunks):
+        """
+        Compress an iterable of ``bytes`` chunks, flushing after each chunk
+        so the client receives it without waiting for the next one.
+        """
+        compressor = self._compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class BrotliEncoder(GzipEncoder):
+    """``Content-Encoding: br``. Requires ``brotli``."""
+    name = 'br'
+    default_level = 4
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.level)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class ZstdEncoder(GzipEncoder):
+    """``Content-Encoding: zstd``. Requires ``zstandard``."""
+    name = 'zstd'
+    default_level = 3
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self, chunks):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + \
+                compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def available_encoders():
+    """
+    :returns: The encoder classes which can be used, most preferred first.
+    """
+    encoders = []
+    if zstandard is not None:
+        encoders.append(ZstdEncoder)
+    if brotli is not None:
+        encoders.append(BrotliEncoder)
+    encoders.append(GzipEncoder)
+    return encoders
+
+
+def _close_after(chunks, iterable):
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+class Compressor(object):
+    """
+    Compresses responses with the best encoding the client accepts.
+
+    :param encodings: (optional) The names of the encodings to use, most
+                      preferred first. Those which aren't installed are
+                      skipped. (Default: ``zstd``, ``br`` then ``gzip``)
+    :param levels: (optional) A dict of encoding name to compression level,
+                   e.g. ``{'gzip': 9, 'br': 11}``. (Defaults: ``gzip``: 6,
+                   ``br``: 4, ``zstd``: 3)
+    :param min_size: (optional) Bodies smaller than this many bytes are sent
+                     uncompressed. (Default: ``500``)
+    :param thread_threshold: (optional) Bodies of at least this many bytes
+                             are compressed in a worker thread, which keeps
+                             green-threaded servers (e.g. gevent) responsive.
+                             (Default: ``None``, never)
+    :param executor: (optional) The ``concurrent.futures`` executor to
+                     compress with. (Default: a shared thread pool)
+    :param mimetypes: (optional) The mimetypes to compress. ``text/*`` is
+                      always compressed. (Default:
+                      :data:`COMPRESSIBLE_MIMETYPES`)
+
+    Streamed responses (e.g. from
+    :func:`~twopi_flask_utils.pagination.streamed`) are compressed chunk by
+    chunk as they are sent.
+    """
+
+    def __init__(self, encodings=None, levels=None, min_size=500,
+                 thread_threshold=None, executor=None,
+                 mimetypes=COMPRESSIBLE_MIMETYPES):
+        levels = levels or {}
+        available = dict((cls.name, cls) for cls in available_encoders())
+        if encodings is None:
+            encodings = [cls.name for cls in available_encoders()]
+
+        self.encoders = dict(
+            (name, available[name](levels.get(name)))
+            for name in encodings if name in available)
+        self.encodings = [name for name in encodings if name in self.encoders]
+        self.min_size = min_size
+        self.thread_threshold = thread_threshold
+        self.executor = executor
+        self.mimetypes = mimetypes
+
+    def init_app(self, app):
+        """Compress every response of ``app``."""
+        app.after_request(self.compress_response)
+
+    def negotiate(self):
+        """
+        :returns: The encoder for the best encoding accepted by the current
+                  request, or ``None``.
+        """
+        name = request.accept_encodings.best_match(self.encodings)
+        if name is None:
+            return None
+        return self.encoders[name]
+
+    def _compressible(self, resp):
+        if resp.status_code < 200 or resp.status_code in (204, 206, 304):
+            return False
+
+        if resp.direct_passthrough or 'Content-Encoding' in resp.headers:
+            return False
+
+        mimetype = resp.mimetype or ''
+        return mimetype.startswith('text/') or mimetype in self.mimetypes
+
+    def _compress(self, encoder, data):
+        if self.thread_threshold is None or len(data) < self.thread_threshold:
+            return encoder.compress(data)
+
+        executor = self.executor or _compression_executor()
+        return executor.submit(encoder.compress, data).result()
+
+    def compress_response(self, resp):
+        """
+        Compress ``resp`` in place if the client accepts a supported
+        encoding.
+
+        :returns: ``resp``
+        """
+        if self.encodings:
+            # Before the other checks, so a 304 (which has no body or
+            # Content-Type left to check) varies like the response it
+            # revalidates.
+            resp.vary.add('Accept-Encoding')
+
+        if not self._compressible(resp) or request.method == 'HEAD':
+            return resp
+
+        if not resp.is_streamed:
+            data = resp.get_data()
+            if len(data) < self.min_size:
+                return resp
+
+        encoder = self.negotiate()
+        if encoder is None:
+            return resp
+
+        if resp.is_streamed:
+            original = resp.response
+            resp.response = _close_after(encoder.stream(resp.iter_encoded()), original)
+            resp.headers.pop('Content-Length', None)
+        else:
+            resp.set_data(self._compress(encoder, data))
+
+        resp.headers['Content-Encoding'] = encoder.name
+
+        # The compressed body is a different representation, so it can't
+        # share a strong ETag with the uncompressed one.
+        etag, weak = resp.get_etag()
+        if etag is not None and not weak:
+            resp.set_etag(etag, weak=True)
+
+        return resp
+
+
+def get_compressor():
+    """
+    :returns: The ``RESPONSE_COMPRESSOR`` of the current app, or ``None``.
+    """
+    return current_app.config.get('RESPONSE_COMPRESSOR')
+
+
+__all__ = ['Compressor', 'GzipEncoder', 'BrotliEncoder', 'ZstdEncoder',
+           'available_encoders', 'get_compressor']
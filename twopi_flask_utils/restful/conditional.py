@@ -0,0 +1,148 @@
+"""
+ETags and conditional (``If-None-Match``) requests.
+
+:func:`~twopi_flask_utils.restful.output_json` gives successful ``GET``
+responses a strong ETag computed from the encoded body, and responds with a
+``304 Not Modified`` (and no body) when the client already has it. Resources
+can provide their own ETag by returning an ``ETag`` header, e.g.
+``return data, 200, {'ETag': '"{}"'.format(version)}``.
+
+That still runs the view and encodes its response. :func:`conditional` can
+skip both by checking a cheap version key before the view is called.
+"""
+import hashlib
+from functools import wraps
+from flask import Response, make_response, request
+from werkzeug.datastructures import Headers
+from werkzeug.http import quote_etag
+
+#: The methods whose responses are given ETags.
+CONDITIONAL_METHODS = frozenset(['GET', 'HEAD'])
+
+
+def body_etag(body):
+    """
+    :param body: ``bytes``: An encoded response body.
+    :returns: A strong ETag value for ``body``.
+    """
+    return hashlib.sha1(body).hexdigest()
+
+
+def version_etag(version):
+    """
+    :param version: A value which changes whenever the resource does, e.g.
+                    a tuple of the most recent ``updated_at`` and the number
+                    of rows. It must have a stable ``repr``.
+    :returns: An ETag value for ``version``.
+    """
+    return hashlib.sha1(repr(version).encode('UTF-8')).hexdigest()
+
+
+def make_conditional(resp):
+    """
+    Give ``resp`` a strong ETag from its body if it doesn't have an ETag
+    already, and turn it into a ``304`` if it matches the request's
+    ``If-None-Match``.
+
+    Only successful ``GET`` and ``HEAD`` responses which aren't streamed
+    are affected.
+    """
+    if resp.status_code != 200 or request.method not in CONDITIONAL_METHODS:
+        return resp
+
+    if 'ETag' not in resp.headers:
+        if resp.is_streamed:
+            return resp
+        resp.set_etag(body_etag(resp.get_data()))
+
+    return resp.make_conditional(request)
+
+
+def _unpack_rv(rv):
+    # Split any of the return values supported by Flask and Flask-Restful
+    # views into ``(rv, status, headers)``.
+    status, headers = 200, None
+    if isinstance(rv, tuple):
+        if len(rv) == 3:
+            rv, status, headers = rv
+        elif len(rv) == 2 and isinstance(rv[1], (Headers, dict, list)):
+            rv, headers = rv
+        elif len(rv) == 2:
+            rv, status = rv
+    return rv, status, headers
+
+
+def _add_header(rv, name, value):
+    # Add a header to any of the return values supported by Flask and
+    # Flask-Restful views.
+    if isinstance(rv, Response):
+        if rv.status_code == 200:
+            rv.headers[name] = value
+        return rv
+
+    rv, status, headers = _unpack_rv(rv)
+    if status != 200:
+        return rv, status, headers
+
+    headers = Headers(headers or {})
+    headers[name] = value
+    return rv, status, headers
+
+
+def conditional(version=None, weak=True):
+    """
+    A decorator to support conditional requests on a view.
+
+    With ``version``, a callable which is called with the view's arguments
+    and returns a cheap version key for the resource (see
+    :func:`version_etag`), the key is checked against ``If-None-Match``
+    before the view is called. If it matches, a ``304`` is returned without
+    running the view or encoding its response at all. Otherwise the view's
+    response is given the ETag. Works with both Flask views and Flask-Restful
+    resources:
+
+    .. code-block:: python
+
+        def items_version():
+            return db.session.query(func.max(Item.updated_at),
+                                    func.count(Item.id)).one()
+
+        @app.route('/items')
+        @conditional(items_version)
+        def list_items():
+            ...
+
+    The ETag is weak, since the response body isn't guaranteed to be byte
+    for byte identical for the same version, unless ``weak=False``.
+
+    Without ``version``, the view is run and its response is given a strong
+    ETag computed from the body, as :func:`~twopi_flask_utils.restful.output_json`
+    does for Flask-Restful resources. This only saves bandwidth.
+
+    :param version: (optional) A callable returning the version key.
+    :param weak: (optional, ``bool``) Whether ETags from ``version`` are weak.
+                 (Default: ``True``)
+    """
+    def wrapper(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if request.method not in CONDITIONAL_METHODS:
+                return f(*args, **kwargs)
+
+            if version is None:
+                return make_conditional(make_response(f(*args, **kwargs)))
+
+            etag = version_etag(version(*args, **kwargs))
+            # If-None-Match always uses the weak comparison (RFC 7232).
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag, weak=weak)
+                return resp
+
+            return _add_header(f(*args, **kwargs), 'ETag', quote_etag(etag, weak))
+
+        return wrapped
+    return wrapper
+
+
+__all__ = ['conditional', 'body_etag', 'version_etag', 'make_conditional']
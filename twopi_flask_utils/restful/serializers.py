@@ -0,0 +1,136 @@
+"""
+JSON serializers used to encode the responses of the ``restful`` and
+``webargs`` helpers.
+
+:class:`StdlibSerializer` is used by default. The faster
+:class:`OrjsonSerializer` requires `orjson <https://github.com/ijl/orjson>`_
+(``pip install twopi-flask-utils[orjson]``) and changes how some types are
+encoded, so it must be enabled with the ``JSON_SERIALIZER`` config key:
+
+.. code-block:: python
+
+    app.config['JSON_SERIALIZER'] = OrjsonSerializer()
+"""
+import decimal
+from flask import Response, current_app, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONSerializer(object):
+    """
+    Encodes data as JSON. Subclasses implement :meth:`dumps`.
+    """
+
+    #: The mimetype of responses built by :meth:`response`.
+    mimetype = 'application/json'
+
+    def dumps(self, data):
+        """
+        :returns: ``bytes``: ``data`` encoded as UTF-8 JSON.
+        """
+        raise NotImplementedError()
+
+    def loads(self, data):
+        """
+        Decode ``data`` (``bytes``).
+
+        :raises ValueError: If ``data`` isn't valid JSON.
+        """
+        raise NotImplementedError()
+
+    def response(self, data, status=None, headers=None):
+        """
+        Build a ``Response`` with ``data`` encoded as its body.
+        """
+        return Response(self.dumps(data), status=status, headers=headers,
+                        mimetype=self.mimetype)
+
+
+class StdlibSerializer(JSONSerializer):
+    """
+    Encodes with ``flask.json``, and so with the application's
+    ``json_encoder`` (and ``simplejson``, if it is installed). Unlike
+    ``jsonify``, the output is never pretty-printed.
+    """
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('UTF-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        # Serialized as a string, so no precision is lost.
+        return str(obj)
+
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+
+    if current_app:
+        # Anything else the app knows how to encode.
+        provider = getattr(current_app, 'json', None)
+        if hasattr(provider, 'default'):
+            # Flask >= 2.2
+            return provider.default(obj)
+        return current_app.json_encoder().default(obj)
+
+    raise TypeError("Type is not JSON serializable: {}".format(type(obj).__name__))
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Encodes with ``orjson``, straight to ``bytes``.
+
+    ``datetime``, ``date``, ``UUID`` and dataclass instances are encoded
+    natively. Note that datetimes are encoded in ISO 8601 format, rather than
+    the HTTP date format used by Flask's encoder. ``Decimal`` is encoded as
+    a string. Any other type is encoded with the app's JSON encoder. Dicts
+    may have non-string keys, as with the standard library.
+
+    :param default: (optional) A callable to encode any other type, which
+                    should return something ``orjson`` can encode or raise a
+                    ``TypeError``.
+    :param option: (optional) Extra ``orjson.OPT_*`` flags.
+    """
+
+    def __init__(self, default=_orjson_default, option=0):
+        if orjson is None:
+            raise RuntimeError("OrjsonSerializer requires orjson to be installed")
+
+        self.default = default
+        self.option = orjson.OPT_NON_STR_KEYS | option
+
+    def dumps(self, data):
+        return orjson.dumps(data, default=self.default, option=self.option)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+default_serializer = StdlibSerializer()
+
+
+def get_serializer():
+    """
+    :returns: The ``JSON_SERIALIZER`` of the current app, or the default
+              serializer.
+    """
+    return current_app.config.get('JSON_SERIALIZER') or default_serializer
+
+
+def json_response(data, status=None, headers=None):
+    """
+    Build a JSON ``Response`` for ``data`` with the current serializer. A
+    faster replacement for ``jsonify``.
+    """
+    return get_serializer().response(data, status, headers)
+
+
+__all__ = ['JSONSerializer', 'StdlibSerializer', 'OrjsonSerializer',
+           'get_serializer', 'json_response']
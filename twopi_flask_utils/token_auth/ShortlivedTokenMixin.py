@@ -1,14 +1,62 @@
 import pytz
 import datetime
+import threading
+from collections import namedtuple
 import jwt
-from marshmallow import fields, Schema, post_dump
-from flask import current_app
+from marshmallow import fields, Schema, ValidationError, post_dump
+from flask import current_app, jsonify
+from twopi_flask_utils.restful import format_error
+from .keyring import resolve_keyring
 import logging
 
 log = logging.getLogger(__name__)
 
 EPOCH_DT = datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)
 
+
+class InvalidToken(Exception):
+    """
+    Raised when a token could not be loaded. ``str()`` gives the reason.
+    """
+    #: The error returned to the client by :meth:`handle`.
+    response_message = "The provided token was invalid."
+
+    @classmethod
+    def handle(cls, exc):
+        """
+        A handler for this type of exception, which responds with a ``401``.
+        Register it when tokens are loaded lazily (see
+        :func:`~twopi_flask_utils.token_auth.parse_auth_header`).
+
+        Usage:
+
+        .. code-block:: python
+
+            app.errorhandler(InvalidToken)(InvalidToken.handle)
+
+        """
+        return jsonify(format_error(exc.response_message)), 401
+
+
+class RevokedToken(InvalidToken):
+    """
+    Raised when a lazily loaded token has been revoked.
+    """
+    response_message = "The provided token has been revoked."
+
+
+#: The result of loading a single token with
+#: :meth:`ShortlivedTokenMixin.load_many`.
+TokenResult = namedtuple('TokenResult', ['token', 'error'])
+
+
+def _app_secret():
+    config = current_app.config
+    keyring = config.get('TOKEN_KEYRING')
+    if keyring is not None:
+        return keyring
+    return config['SECRET_KEY']
+
 class UnixTimestamp(fields.Field):
     def _serialize(self, value, attr, obj):
         if value is None:
@@ -35,12 +83,33 @@ class ShortlivedTokenMixin(object):
                                      valid for use
     :param issued_at: ``datetime``: When the token was issued. This value is 
                                     overwritten during ``dump()``
+    :param token_id: ``string``: A unique id for this token (the ``jti``
+                                 claim), e.g. for revocation.
+
+    Verified tokens can be cached by setting ``TOKEN_CACHE`` to a
+    :class:`~twopi_flask_utils.caching.LRUCache`. Subsequent calls to
+    :meth:`load` with the same token string (and verification arguments)
+    return the cached instance until the token's ``exp``, skipping decoding
+    and signature verification:
+
+    .. code-block:: python
+
+        class ShortlivedToken(ShortlivedTokenMixin):
+            TOKEN_CACHE = LRUCache(maxsize=4096, ttl=300)
+
+    ``ttl`` bounds how long tokens without an ``exp`` are cached. The cache's
+    ``hits`` and ``misses`` counters report its effectiveness. Cached instances
+    are shared between requests, so they should be treated as read-only.
+
+    A cache hit skips the keyring entirely, so a token signed with a key
+    which has since been removed keeps loading until its entry expires.
+    Call ``TOKEN_CACHE.clear()`` after rotating keys out of the keyring.
     """
     class TokenSchema(Schema):
         """
         The schema to use to serialize/de-serialize JWT's with.
         """
-        SKIPPABLE = ['exp', 'iss', 'sub', 'aud', 'nbf', 'iat']
+        SKIPPABLE = frozenset(['exp', 'iss', 'sub', 'aud', 'nbf', 'iat', 'jti'])
 
         exp = UnixTimestamp(attribute='expiry')
         iss = fields.String(attribute='issuer')
@@ -48,20 +117,26 @@ class ShortlivedTokenMixin(object):
         aud = fields.String(attribute='audience')
         nbf = UnixTimestamp(attribute='not_before')
         iat = UnixTimestamp(attribute='issued_at')
+        jti = fields.String(attribute='token_id')
 
         @post_dump
         def remove_skippable(self, data):
             return {key: value for key, value in data.items() 
                     if key not in self.SKIPPABLE or value is not None}
 
+    #: An optional :class:`~twopi_flask_utils.caching.LRUCache` of verified
+    #: tokens.
+    TOKEN_CACHE = None
+
     def __init__(self, expiry=None, issuer=None, subject=None, audience=None, 
-                 not_before=None, issued_at=None):
+                 not_before=None, issued_at=None, token_id=None):
         self.expiry = expiry
         self.issuer = issuer
         self.subject = subject
         self.audience = audience
         self.not_before = not_before
         self.issued_at = issued_at
+        self.token_id = token_id
 
     @classmethod
     def generate(Cls, refresh_token):
@@ -97,52 +172,252 @@ class ShortlivedTokenMixin(object):
         Load from a JWT (``token_string``)
 
         :param token_string: The raw string to load from
-        :param secret: The secret that the JWT was signed with to check validity. 
-                       If this is omitted, the secret will be sourced 
+        :param secret: The secret that the JWT was signed with to check validity,
+                       or a :class:`Keyring` to look the token's ``kid`` up in.
+                       If this is omitted, the keyring will be sourced from
+                       ``current_app.config['TOKEN_KEYRING']``, or the secret
                        from ``current_app.config['SECRET_KEY']``
         :param issuer: The issuer the JWT decode should expect
         :param audience: The audience the JWT decode should expect
-        :returns: A de-serialized ShortLivedToken instance.
+        :returns: A de-serialized ShortLivedToken instance, or ``None`` if the
+                  token was invalid.
+        """
+        try:
+            return Cls.verify(token_string, secret, issuer, audience)
+        except InvalidToken as e:
+            log.info(str(e))
+            return None
+
+    @classmethod
+    def verify(Cls, token_string, secret=None, issuer=None, audience=None):
+        """
+        The same as :meth:`load`, but raises :class:`InvalidToken` with the
+        reason the token was rejected instead of returning ``None``.
         """
 
         if secret is None:
-            secret = current_app.config['SECRET_KEY']
+            secret = _app_secret()
+
+        cache = Cls.TOKEN_CACHE
+        if cache is not None:
+            cache_key = (Cls, token_string, secret, issuer, audience)
+            token = cache.get(cache_key)
+            if token is not None:
+                return token
 
         try:
-            payload = jwt.decode(token_string, secret, issuer=issuer, audience=audience)
+            header = jwt.get_unverified_header(token_string)
+            key = resolve_keyring(secret).verification_key(header.get('kid'))
+            if key is None:
+                raise jwt.exceptions.InvalidTokenError("Unknown key id")
+
+            algorithm, key = key
+            payload = jwt.decode(token_string, key, algorithms=[algorithm],
+                                 issuer=issuer, audience=audience)
         except (jwt.exceptions.InvalidTokenError) as e:
-            log.info("The provided token has expired or was malformed. {}".format(e))
-            return None
+            raise InvalidToken(
+                "The provided token has expired or was malformed. {}".format(e))
 
-        deserialized, errs = Cls.TokenSchema().load(payload)
-        if errs:
+        try:
+            deserialized = claim_codec(Cls.TokenSchema).load(payload)
+        except (ValidationError, TypeError, ValueError):
             # Malformed token?
-            log.info("Malformed token was provided, error during de-serialisation.")
-            return None
+            raise InvalidToken(
+                "Malformed token was provided, error during de-serialisation.")
         try:
-            return Cls(**deserialized)
+            token = Cls(**deserialized)
         except TypeError:
-            log.info("Malformed token was provided, error during instantiation.")
-            return None
+            raise InvalidToken(
+                "Malformed token was provided, error during instantiation.")
+
+        if cache is not None:
+            Cls._cache_token(cache, cache_key, token)
+
+        return token
+
+    @classmethod
+    def load_many(Cls, token_strings, secret=None, issuer=None, audience=None,
+                  executor=None, max_workers=None):
+        """
+        Load many JWTs at once, e.g. to re-validate every connection of a
+        websocket gateway.
+
+        Each distinct token is only verified once. Verification is spread
+        across a thread pool; ``cryptography`` releases the GIL while checking
+        signatures, so asymmetric tokens in particular are verified in
+        parallel.
+
+        :param token_strings: A list of raw token strings.
+        :param secret: See :meth:`load`.
+        :param issuer: See :meth:`load`.
+        :param audience: See :meth:`load`.
+        :param executor: (optional) A ``concurrent.futures.Executor`` to verify
+                         tokens in. If omitted a thread pool is created for
+                         the call.
+        :param max_workers: (optional) The size of the thread pool to create
+                            if no ``executor`` is given.
+        :returns: A list of :class:`TokenResult`, in the same order as
+                  ``token_strings``. Each is a ``(token, error)`` tuple, where
+                  ``error`` is the reason the token was rejected, or ``None``.
+        """
+        # Resolve the secret now: the pool's threads have no app context.
+        if secret is None:
+            secret = _app_secret()
+
+        unique = list(set(token_strings))
+
+        def verify(token_string):
+            try:
+                token = Cls.verify(token_string, secret, issuer, audience)
+            except InvalidToken as e:
+                return TokenResult(None, str(e))
+            return TokenResult(token, None)
+
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = dict(zip(unique, pool.map(verify, unique)))
+        else:
+            results = dict(zip(unique, executor.map(verify, unique)))
+
+        return [results[token_string] for token_string in token_strings]
+
+    @staticmethod
+    def _cache_token(cache, cache_key, token):
+        if token.expiry is None:
+            cache.set(cache_key, token)
+            return
+
+        # Only keep the token for as long as it is valid. It has already been
+        # checked against ``nbf`` by ``jwt.decode``.
+        ttl = (token.expiry - EPOCH_DT).total_seconds() - cache.timer()
+        if ttl > 0:
+            cache.set(cache_key, token, ttl=ttl)
 
     def dump(self, secret=None):
         """
         Dump the token into a stringified JWT.
 
-        :param secret: The secret to sign the JWT with. If this is omitted, the 
-                       secret will be sourced from ``current_app.config['SECRET_KEY']``
+        :param secret: The secret to sign the JWT with, or a :class:`Keyring` to
+                       sign it with the active key of. If this is omitted, the
+                       keyring will be sourced from
+                       ``current_app.config['TOKEN_KEYRING']``, or the secret
+                       from ``current_app.config['SECRET_KEY']``
 
         :returns: The stringified JWT.
         """
 
         self.issued_at = datetime.datetime.now(pytz.UTC)
-        payload, err = self.TokenSchema().dump(self)
+        payload = claim_codec(self.TokenSchema).dump(self)
 
         if secret is None:
-            secret = current_app.config['SECRET_KEY']
+            secret = _app_secret()
 
-        return jwt.encode(payload, secret).decode('UTF-8')
+        kid, algorithm, key = resolve_keyring(secret).signing_key()
+        headers = {'kid': kid} if kid is not None else None
+        return jwt.encode(payload, key, algorithm=algorithm,
+                          headers=headers).decode('UTF-8')
 
 
     def __repr__(self):
         return "<ShortlivedToken expiry={}>".format(self.expiry)
+
+
+class ClaimCodec(object):
+    """
+    Dumps and loads the claims of a ``TokenSchema`` class.
+
+    The standard claims (``exp``, ``iss``, ``sub``, ``aud``, ``nbf``, ``iat``
+    and ``jti``) are mapped to and from their attributes directly, without going
+    through marshmallow's marshalling machinery. Any other fields declared on
+    the schema are handled by a schema instance restricted to those fields,
+    which is reused (one per thread) rather than created per token.
+
+    If the schema overrides a standard claim's field, adds processors or
+    declares ``Meta`` options, the whole schema is used instead.
+
+    Use :func:`claim_codec` to get the codec for a schema class.
+    """
+
+    STANDARD_CLAIMS = frozenset(['exp', 'iss', 'sub', 'aud', 'nbf', 'iat', 'jti'])
+
+    def __init__(self, schema_cls):
+        base = ShortlivedTokenMixin.TokenSchema
+        compilable = schema_cls.Meta is Schema.Meta and \
+            schema_cls.__processors__ == base.__processors__
+
+        self.schema_cls = schema_cls
+        self.standard = []
+        custom = []
+        for name, field in schema_cls._declared_fields.items():
+            if compilable and name in self.STANDARD_CLAIMS and \
+                    field is base._declared_fields.get(name):
+                self.standard.append((name, field.attribute, field))
+            else:
+                custom.append(name)
+
+        self.only = tuple(custom) if compilable else None
+        self.use_schema = bool(custom)
+        self._local = threading.local()
+
+    def _schema(self):
+        schema = getattr(self._local, 'schema', None)
+        if schema is None:
+            schema = self._local.schema = self.schema_cls(only=self.only)
+        return schema
+
+    def dump(self, obj):
+        """
+        Dump ``obj``'s attributes into a dict of claims.
+        """
+        data = {}
+        for name, attribute, field in self.standard:
+            value = field._serialize(getattr(obj, attribute, None), attribute, obj)
+            if value is not None:
+                data[name] = value
+
+        if self.use_schema:
+            custom, errors = self._schema().dump(obj)
+            data.update(custom)
+
+        return data
+
+    def load(self, data):
+        """
+        Load a dict of claims into constructor keyword arguments.
+
+        Raises a ``ValidationError`` if the claims are malformed.
+        """
+        kwargs = {}
+        for name, attribute, field in self.standard:
+            if name in data:
+                value = data[name]
+                if value is None:
+                    raise ValidationError('Field may not be null.', name)
+                kwargs[attribute] = field._deserialize(value, attribute, data)
+
+        if self.use_schema:
+            custom, errors = self._schema().load(data)
+            if errors:
+                raise ValidationError(errors)
+            kwargs.update(custom)
+
+        return kwargs
+
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def claim_codec(schema_cls):
+    """
+    Return the :class:`ClaimCodec` for ``schema_cls``, creating it the first
+    time it is requested.
+    """
+    codec = _codecs.get(schema_cls)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(schema_cls)
+            if codec is None:
+                codec = _codecs[schema_cls] = ClaimCodec(schema_cls)
+    return codec
@@ -1,4 +1,16 @@
-from .ShortlivedTokenMixin import ShortlivedTokenMixin
-from .decorators import auth_required, parse_auth_header
+from .ShortlivedTokenMixin import (ShortlivedTokenMixin, InvalidToken, RevokedToken,
+                                   TokenResult)
+from .keyring import Keyring
+from .revocation import (RevocationBackend, MemoryRevocationBackend,
+                         RedisRevocationBackend, SQLRevocationBackend,
+                         RevocationList)
+from .decorators import (auth_required, parse_auth_header, HeaderTokenSource,
+                         QueryStringTokenSource, CookieTokenSource, current_token,
+                         token_scopes)
 
-__all__ = ['ShortlivedTokenMixin', 'auth_required', 'parse_auth_header']
\ No newline at end of file
+__all__ = ['ShortlivedTokenMixin', 'InvalidToken', 'RevokedToken', 'TokenResult',
+           'Keyring', 'auth_required', 'parse_auth_header', 'current_token',
+           'token_scopes', 'HeaderTokenSource', 'QueryStringTokenSource',
+           'CookieTokenSource',
+           'RevocationBackend', 'MemoryRevocationBackend', 'RedisRevocationBackend',
+           'SQLRevocationBackend', 'RevocationList']
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Coroutine variants of the token auth decorators, used automatically by
+:func:`~twopi_flask_utils.token_auth.parse_auth_header` and
+:func:`~twopi_flask_utils.token_auth.auth_required` when they wrap an
+``async def`` view. Requires Python 3.5+.
+
+Verifying a token is CPU bound and fast, so it runs inline unless the token
+class provides a ``load_async(raw, secret)`` coroutine classmethod (e.g. to
+fetch keys remotely). Revocation backend lookups are awaited if the backend
+implements ``is_revoked_async``, or run in the loop's default executor
+otherwise.
+
+Quart applications can use these through ``quart.flask_patch``.
+"""
+import asyncio
+from functools import wraps
+from flask import g
+from .ShortlivedTokenMixin import InvalidToken
+from .decorators import (current_token, extract_raw_token, insufficient_scope_response,
+                         invalid_token_response, lazy_token, load_checked_token,
+                         revoked_token_response, token_required_response)
+
+
+async def load_token(token_cls, raw_token, secret=None):
+    """
+    Load ``raw_token`` with ``token_cls.load_async`` if it is implemented,
+    otherwise ``token_cls.load``.
+    """
+    load_async = getattr(token_cls, 'load_async', None)
+    if load_async is not None:
+        return await load_async(raw_token, secret)
+    return token_cls.load(raw_token, secret)
+
+
+async def is_revoked(revocation, token):
+    """
+    The same as :meth:`.RevocationList.is_revoked`, without blocking the
+    event loop on the backend.
+    """
+    token_id = revocation.key(token)
+    if token_id is None:
+        return False
+
+    loop = asyncio.get_event_loop()
+    if revocation.needs_refresh():
+        await loop.run_in_executor(None, revocation.refresh)
+
+    if not revocation.might_be_revoked(token_id):
+        return False
+
+    backend = revocation.backend
+    is_revoked_async = getattr(backend, 'is_revoked_async', None)
+    if is_revoked_async is not None:
+        revoked = await is_revoked_async(token_id)
+    else:
+        revoked = await loop.run_in_executor(None, backend.is_revoked, token_id)
+
+    return revocation._record_backend_check(revoked)
+
+
+def parse_auth_header_async(f, token_cls, sources, secret=None, revocation=None,
+                            lazy=False):
+    """
+    Wrap the coroutine function ``f``. See
+    :func:`~twopi_flask_utils.token_auth.parse_auth_header`.
+    """
+    @wraps(f)
+    async def wrapped(*args, **kwargs):
+        g.token = None
+        g.raw_token = None
+        raw_token = extract_raw_token(sources)
+
+        if raw_token is not None and lazy:
+            g.token = lazy_token(
+                lambda: load_checked_token(token_cls, raw_token, secret, revocation))
+            g.raw_token = raw_token
+
+        elif raw_token is not None:
+            token = await load_token(token_cls, raw_token, secret)
+            if token is None:
+                return invalid_token_response()
+
+            if revocation is not None and await is_revoked(revocation, token):
+                return revoked_token_response()
+
+            g.token = token
+            g.raw_token = raw_token
+
+        return await f(*args, **kwargs)
+
+    return wrapped
+
+
+def auth_required_async(f, requirements=None):
+    """
+    Wrap the coroutine function ``f``. See
+    :func:`~twopi_flask_utils.token_auth.auth_required`.
+    """
+    @wraps(f)
+    async def wrapped(*args, **kwargs):
+        try:
+            token = current_token()
+        except InvalidToken as exc:
+            return exc.handle(exc)
+
+        if token is None:
+            return token_required_response()
+
+        if requirements is not None and not requirements(token):
+            return insufficient_scope_response()
+
+        return await f(*args, **kwargs)
+
+    return wrapped
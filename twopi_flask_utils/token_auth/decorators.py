@@ -1,14 +1,234 @@
 from flask import g, request, jsonify
 from functools import wraps
+from werkzeug.local import LocalProxy
 from twopi_flask_utils.restful import format_error
-import re
+from .ShortlivedTokenMixin import InvalidToken, RevokedToken
 
-bearer_re = re.compile(r'Bearer (.+)')
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    # Python 2 has no coroutine functions.
+    def iscoroutinefunction(f):
+        return False
 
-def parse_auth_header(token_cls, auth_header=True, query_string=True, secret=None):
+
+class HeaderTokenSource(object):
+    """
+    Reads a token from a header in the format ``<scheme> <token>``, e.g.
+    ``Authorization: Bearer <token>``. The scheme is case-insensitive.
+
+    :param header: (optional) The header name. (Default: ``Authorization``)
+    :param scheme: (optional) The auth scheme. (Default: ``Bearer``)
+    """
+
+    def __init__(self, header='Authorization', scheme='Bearer'):
+        self.header = header
+        self.scheme = scheme.lower()
+
+    def __call__(self):
+        value = request.headers.get(self.header)
+        if not value:
+            return None
+
+        scheme, _, token = value.partition(' ')
+        if scheme.lower() != self.scheme:
+            return None
+
+        # Reject rather than repair malformed values, e.g. ``Bearer abc ``.
+        if not token or token != token.strip() or ' ' in token or '\t' in token:
+            return None
+
+        return token
+
+
+class QueryStringTokenSource(object):
+    """
+    Reads a token from a query string parameter.
+
+    :param name: (optional) The parameter name. (Default: ``token``)
+    """
+
+    def __init__(self, name='token'):
+        self.name = name
+
+    def __call__(self):
+        return request.args.get(self.name) or None
+
+
+class CookieTokenSource(object):
+    """
+    Reads a token from a cookie.
+
+    :param name: (optional) The cookie name. (Default: ``token``)
+    """
+
+    def __init__(self, name='token'):
+        self.name = name
+
+    def __call__(self):
+        return request.cookies.get(self.name) or None
+
+
+def default_token_sources(auth_header=True, query_string=True):
+    """
+    :returns: The token sources used by :func:`parse_auth_header` when no
+              ``sources`` are given.
+    """
+    sources = []
+    if auth_header:
+        sources.append(HeaderTokenSource())
+    if query_string:
+        sources.append(QueryStringTokenSource())
+    return sources
+
+
+def extract_raw_token(sources):
+    """
+    Extract the raw token string from the current request, trying each of
+    ``sources`` in turn and stopping at the first one which finds a token.
+
+    :returns: The raw token string, or ``None`` if one wasn't provided.
+    """
+    for source in sources:
+        raw_token = source()
+        if raw_token is not None:
+            return raw_token
+    return None
+
+
+def invalid_token_response():
+    return jsonify(format_error("The provided token was invalid.")), 401
+
+
+def revoked_token_response():
+    return jsonify(format_error("The provided token has been revoked.")), 401
+
+
+def token_required_response():
+    return jsonify(
+        format_error("A valid token is required to access this resource")), 401
+
+
+def insufficient_scope_response():
+    return jsonify(
+        format_error("The provided token does not grant access to this resource")), 403
+
+
+def token_scopes(token, attr='scopes'):
+    """
+    The scopes of ``token`` as a ``frozenset``. The set is built the first
+    time it is needed and remembered on the token, so a token's scopes are
+    converted once, however many endpoints check them (tokens in the
+    :attr:`~.ShortlivedTokenMixin.TOKEN_CACHE` are reused across requests).
+
+    :param attr: (optional) The attribute holding the token's list of
+                 scopes. (Default: ``scopes``)
+    """
+    cache = token.__dict__.get('_scope_sets')
+    if cache is None:
+        cache = token._scope_sets = {}
+
+    scopes = cache.get(attr)
+    if scopes is None:
+        scopes = cache[attr] = frozenset(getattr(token, attr, None) or ())
+    return scopes
+
+
+class TokenRequirements(object):
+    """
+    The scopes and claims a token needs to access an endpoint, compiled once
+    when the endpoint is decorated. See :func:`auth_required`.
+    """
+
+    def __init__(self, scopes=None, claims=None, scopes_attr='scopes'):
+        self.scopes = frozenset(scopes or ())
+        self.scopes_attr = scopes_attr
+        self.claims = tuple(
+            (attr, frozenset(value) if isinstance(value, (list, tuple, set, frozenset))
+             else frozenset([value]))
+            for attr, value in (claims or {}).items())
+
+    def __bool__(self):
+        return bool(self.scopes or self.claims)
+
+    __nonzero__ = __bool__
+
+    def __call__(self, token):
+        """
+        :returns: ``True`` if ``token`` meets every requirement.
+        """
+        if self.scopes and not self.scopes <= token_scopes(token, self.scopes_attr):
+            return False
+
+        for attr, allowed in self.claims:
+            try:
+                if getattr(token, attr, None) not in allowed:
+                    return False
+            except TypeError:
+                # An unhashable value, which can't be one of the allowed ones.
+                return False
+
+        return True
+
+
+def load_checked_token(token_cls, raw_token, secret=None, revocation=None):
+    """
+    Load ``raw_token`` with ``token_cls.load`` and check it against
+    ``revocation``.
+
+    :raises InvalidToken: If the token is invalid.
+    :raises RevokedToken: If the token has been revoked.
+    """
+    token = token_cls.load(raw_token, secret)
+    if token is None:
+        raise InvalidToken("The provided token was invalid.")
+
+    if revocation is not None and revocation.is_revoked(token):
+        raise RevokedToken("The provided token has been revoked.")
+
+    return token
+
+
+def lazy_token(loader):
+    """
+    A proxy to the result of calling ``loader``, which is called on first
+    access only. The result, or the exception raised, is remembered for
+    subsequent accesses.
+    """
+    state = {}
+
+    def resolve():
+        if 'token' not in state:
+            try:
+                state['token'] = loader()
+            except InvalidToken as exc:
+                state['error'] = exc
+                state['token'] = None
+
+        if 'error' in state:
+            raise state['error']
+        return state['token']
+
+    return LocalProxy(resolve)
+
+
+def current_token():
+    """
+    Return ``g.token``, verifying it first if it was loaded lazily.
+
+    :raises InvalidToken: If a lazily loaded token is invalid or revoked.
+    """
+    token = g.token
+    if isinstance(token, LocalProxy):
+        return token._get_current_object()
+    return token
+
+
+def parse_auth_header(token_cls, auth_header=True, query_string=True, secret=None,
+                      revocation=None, sources=None, lazy=False):
     """
     A decorator to extract a token from either the ``Authorization`` header OR
-    the query string parameter ``?token=``.
+    the query string parameter ``?token=``, in that order of priority.
 
     :param token_cls: An instance of :class:`ShortlivedTokenMixin` OR a class which
                       implements the classmethod ``load(token_string, secret)``. 
@@ -18,35 +238,71 @@ def parse_auth_header(token_cls, auth_header=True, query_string=True, secret=Non
     :param query_string: (optional, ``bool``) Extract the token from the query 
                           string (Default: ``True``)
     :param secret: (optional) A secret to pass to ``token_cls.load(raw, secret)``
+    :param revocation: (optional) A :class:`.RevocationList` to reject revoked
+                       tokens with.
+    :param sources: (optional) A list of token sources to use instead of
+                    ``auth_header`` and ``query_string``, in order of
+                    priority. A source is any callable returning the raw
+                    token from the current request, or ``None``, e.g.
+                    :class:`HeaderTokenSource`, :class:`QueryStringTokenSource`
+                    or :class:`CookieTokenSource`. Sources after the first one
+                    to find a token are not consulted.
+    :param lazy: (optional, ``bool``) Defer verifying the token until
+                 ``g.token`` is first used. (Default: ``False``)
 
     Any wrapped function will be able to access both ``g.token`` and ``g.raw_token``
     to read the ``token_cls`` instance and raw token string respectively.
 
     Authorization header expects tokens in the format of ``Bearer <token string>``
 
+    ``async def`` views (e.g. in Flask 2) are wrapped with a coroutine which
+    awaits the view, ``token_cls.load_async(raw, secret)`` if the token class
+    implements it, and the revocation backend's lookups, rather than blocking
+    the event loop. See :mod:`twopi_flask_utils.token_auth.aio`.
+
+    With ``lazy=True``, ``g.token`` is a proxy which verifies the token the
+    first time it is used, so views which never read it (e.g. public
+    endpoints with optional auth) skip verification entirely. The result is
+    remembered for the rest of the request. If the token turns out to be
+    invalid or revoked, :class:`.InvalidToken` (or :class:`.RevokedToken`) is
+    raised where the token was used, which should be turned into a ``401``
+    by registering :meth:`.InvalidToken.handle`:
+
+    .. code-block:: python
+
+        app.errorhandler(InvalidToken)(InvalidToken.handle)
+
+    Note that ``g.token`` is never ``None`` when a token was provided in
+    lazy mode; use :func:`current_token` to check whether a valid token was
+    provided. Lazy tokens are always verified synchronously with
+    ``token_cls.load``, including for ``async def`` views.
+
     """
+    if sources is None:
+        sources = default_token_sources(auth_header, query_string)
+
     def wrapper(f):
+        if iscoroutinefunction(f):
+            from .aio import parse_auth_header_async
+            return parse_auth_header_async(f, token_cls, sources, secret, revocation,
+                                           lazy)
+
         @wraps(f)
         def wrapped(*args, **kwargs):
             g.token = None
             g.raw_token = None
-            raw_token = None
-
-            if query_string and 'token' in request.args:
-                # Try fetch the token from the QS
-                raw_token = request.args['token']
-
-            if auth_header and 'Authorization' in request.headers:
-                token_res = bearer_re.match(request.headers['Authorization'])
-                if token_res is not None:
-                    raw_token = token_res.group(1)
+            raw_token = extract_raw_token(sources)
 
             if raw_token is not None:
-                token = token_cls.load(raw_token, secret)
-                if token is None:
-                    return jsonify(format_error("The provided token was invalid.")), 401
+                if lazy:
+                    g.token = lazy_token(
+                        lambda: load_checked_token(token_cls, raw_token, secret, revocation))
+                else:
+                    try:
+                        g.token = load_checked_token(token_cls, raw_token, secret, revocation)
+                    except InvalidToken as exc:
+                        return exc.handle(exc)
 
-                g.token = token
                 g.raw_token = raw_token
 
             return f(*args, **kwargs)
@@ -55,10 +311,22 @@ def parse_auth_header(token_cls, auth_header=True, query_string=True, secret=Non
     return wrapper
 
 
-def auth_required():
+def auth_required(scopes=None, claims=None, scopes_attr='scopes'):
     """
     Force authentication on an endpoint. Checks if ``g.token`` is not None, 
-    and returns a ``401`` if it is.
+    and returns a ``401`` if it is. A lazily loaded token is verified here.
+
+    :param scopes: (optional) Scopes the token must have, all of which
+                   must be in the token's ``scopes``.
+    :param claims: (optional) A dict of token attribute to the value it must
+                   have, or a list of values it may have.
+    :param scopes_attr: (optional) The token attribute holding its list of
+                        scopes. (Default: ``scopes``)
+
+    If the token doesn't meet ``scopes`` or ``claims``, a ``403`` is returned.
+    Requirements are compiled into sets when the endpoint is decorated, and
+    each token's scopes are converted into a set once (see
+    :func:`token_scopes`), so checking them is a set comparison.
 
     Example:
 
@@ -69,13 +337,34 @@ def auth_required():
         def my_endpoint():
             return "Hello World"
 
+        @app.route('/admin')
+        @auth_required(scopes=['admin'], claims={'issuer': 'twopi'})
+        def admin():
+            return "Hello Admin"
+
+    Also supports ``async def`` views.
     """
+    requirements = TokenRequirements(scopes, claims, scopes_attr)
+    if not requirements:
+        requirements = None
+
     def wrapper(f):
+        if iscoroutinefunction(f):
+            from .aio import auth_required_async
+            return auth_required_async(f, requirements)
+
         @wraps(f)
         def wrapped(*args, **kwargs):
-            if g.token is None:
-                return jsonify(
-                    format_error("A valid token is required to access this resource")), 401
+            try:
+                token = current_token()
+            except InvalidToken as exc:
+                return exc.handle(exc)
+
+            if token is None:
+                return token_required_response()
+
+            if requirements is not None and not requirements(token):
+                return insufficient_scope_response()
 
             return f(*args, **kwargs)
         
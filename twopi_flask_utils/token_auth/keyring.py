@@ -0,0 +1,157 @@
+from jwt.algorithms import get_default_algorithms
+from twopi_flask_utils.caching import LRUCache
+
+
+class Keyring(object):
+    """
+    A set of keys used to sign and verify tokens, indexed by key id
+    (``kid``).
+
+    Tokens are signed with the ``active`` key, and its ``kid`` is stamped
+    into the JWT header. Verification looks the key up by the token's
+    ``kid``, so keys can be rotated without invalidating live tokens: add
+    the new key, make it active, and remove the old key once every token
+    signed with it has expired.
+
+    .. code-block:: python
+
+        app.config['TOKEN_KEYRING'] = Keyring({
+            '2016-01': 'old-secret',
+            '2016-02': 'new-secret',
+        }, active='2016-02', default_kid='2016-01')
+
+    Asymmetric algorithms (``RS256``, ``ES256``, ``PS256``, etc., which
+    require ``cryptography``) are supported by providing PEM encoded keys or
+    ``cryptography`` key objects. A service which only verifies tokens only
+    needs the public keys, and no active key:
+
+    .. code-block:: python
+
+        # Issuer
+        Keyring({'2016-02': PRIVATE_KEY_PEM}, algorithm='RS256')
+
+        # Verifier
+        Keyring({'2016-01': OLD_PUBLIC_KEY_PEM,
+                 '2016-02': PUBLIC_KEY_PEM}, algorithm='RS256')
+
+    Public keys are derived from private keys for verification.
+
+    Key material is parsed/prepared once per key and reused for every token.
+
+    :param keys: A dict of ``kid`` to key material (e.g. a secret string).
+                 A ``(key material, algorithm)`` tuple may be given to use a
+                 different algorithm for that key.
+    :param active: (optional) The ``kid`` of the key to sign tokens with.
+                   May be omitted if there is only one key, or if the
+                   keyring is only used to verify tokens.
+    :param algorithm: (optional) The JWT algorithm. (Default: ``HS256``)
+    :param default_kid: (optional) The ``kid`` of the key to verify tokens
+                        without a ``kid`` header with, e.g. tokens issued
+                        before a keyring was in use.
+    """
+
+    def __init__(self, keys, active=None, algorithm='HS256', default_kid=None):
+        if active is None and len(keys) == 1:
+            active = next(iter(keys))
+
+        if active is not None and active not in keys:
+            raise ValueError("The active key {!r} is not in the keyring".format(active))
+
+        self.keys = {}
+        for kid, material in keys.items():
+            if isinstance(material, tuple):
+                self.keys[kid] = material
+            else:
+                self.keys[kid] = (material, algorithm)
+
+        self.active = active
+        self.algorithm = algorithm
+        self.default_kid = default_kid
+        self._signing = {}
+        self._verification = {}
+
+    @classmethod
+    def from_secret(Cls, secret, algorithm='HS256'):
+        """
+        Create a keyring holding a single key with no ``kid``. Tokens it
+        signs have no ``kid`` header, as was the case before keyrings.
+        """
+        return Cls({None: secret}, algorithm=algorithm)
+
+    def _prepare(self, kid):
+        material, algorithm = self.keys[kid]
+        try:
+            algorithm_obj = get_default_algorithms()[algorithm]
+        except KeyError:
+            raise ValueError("The algorithm {} is not available. Asymmetric "
+                             "algorithms require cryptography to be installed "
+                             "and a version of PyJWT which supports "
+                             "them.".format(algorithm))
+
+        return algorithm, algorithm_obj.prepare_key(material)
+
+    def signing_key(self):
+        """
+        :returns: A tuple of ``(kid, algorithm, key)`` to sign a token with.
+        """
+        kid = self.active
+        prepared = self._signing.get(kid)
+        if prepared is None:
+            if kid not in self.keys:
+                raise ValueError("The keyring has no active key to sign with")
+
+            algorithm, key = self._prepare(kid)
+            if hasattr(key, 'verify') and not hasattr(key, 'sign'):
+                raise ValueError("The active key {!r} is a public key, which "
+                                 "can't sign tokens".format(kid))
+            prepared = self._signing[kid] = (algorithm, key)
+
+        algorithm, key = prepared
+        return kid, algorithm, key
+
+    def verification_key(self, kid):
+        """
+        Look up the key to verify a token with.
+
+        :param kid: The ``kid`` from the token's header, or ``None``.
+        :returns: A tuple of ``(algorithm, key)``, or ``None`` if the
+                  keyring has no such key.
+        """
+        if kid is None:
+            kid = self.default_kid
+
+        try:
+            prepared = self._verification.get(kid)
+        except TypeError:
+            # An unhashable kid, which can't be one of ours.
+            return None
+
+        if prepared is None:
+            if kid not in self.keys:
+                return None
+
+            algorithm, key = self._prepare(kid)
+            if hasattr(key, 'public_key'):
+                # Only the public half of a private key is needed to verify.
+                key = key.public_key()
+            prepared = self._verification[kid] = (algorithm, key)
+
+        return prepared
+
+
+_secret_keyrings = LRUCache(maxsize=64)
+
+
+def resolve_keyring(secret):
+    """
+    Return ``secret`` if it is a :class:`Keyring`, otherwise a (cached)
+    single-key keyring for the secret.
+    """
+    if isinstance(secret, Keyring):
+        return secret
+
+    keyring = _secret_keyrings.get(secret)
+    if keyring is None:
+        keyring = Keyring.from_secret(secret)
+        _secret_keyrings.set(secret, keyring)
+    return keyring
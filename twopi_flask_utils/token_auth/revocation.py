@@ -0,0 +1,325 @@
+import threading
+import time
+from operator import attrgetter
+from twopi_flask_utils.caching import BloomFilter
+
+
+class RevocationBackend(object):
+    """
+    Stores the ids of revoked tokens.
+
+    Subclasses implement :meth:`revoke`, :meth:`is_revoked` and
+    :meth:`revoked_since`. They may also implement a coroutine
+    ``is_revoked_async(token_id)``, which is awaited by the async variants of
+    the decorators instead of running :meth:`is_revoked` in a thread.
+    """
+
+    def revoke(self, token_id):
+        """Mark ``token_id`` as revoked."""
+        raise NotImplementedError()
+
+    def is_revoked(self, token_id):
+        """
+        :returns: ``True`` if ``token_id`` has been revoked.
+        """
+        raise NotImplementedError()
+
+    def revoked_since(self, cursor=None):
+        """
+        Fetch the ids revoked since ``cursor``, to refresh a local index
+        incrementally. Ids may be returned more than once.
+
+        :param cursor: The cursor from the previous call, or ``None`` to
+                       fetch every revoked id.
+        :returns: A tuple of ``(ids, cursor)``.
+        """
+        raise NotImplementedError()
+
+
+class MemoryRevocationBackend(RevocationBackend):
+    """
+    Stores revoked ids in-process. Only suitable for a single process, or
+    for testing.
+    """
+
+    def __init__(self):
+        self._revoked = set()
+        self._log = []
+        self._lock = threading.Lock()
+
+    def revoke(self, token_id):
+        with self._lock:
+            if token_id not in self._revoked:
+                self._revoked.add(token_id)
+                self._log.append(token_id)
+
+    def is_revoked(self, token_id):
+        return token_id in self._revoked
+
+    def revoked_since(self, cursor=None):
+        with self._lock:
+            start = cursor or 0
+            return self._log[start:], len(self._log)
+
+
+def _text(value):
+    return value.decode('UTF-8') if isinstance(value, bytes) else value
+
+
+def _next_stream_id(stream_id):
+    # Stream ids are "<milliseconds>-<sequence>".
+    millis, sequence = _text(stream_id).split('-')
+    return '{}-{}'.format(millis, int(sequence) + 1)
+
+
+class RedisRevocationBackend(RevocationBackend):
+    """
+    Stores revoked ids in a redis set, and logs each revocation to a redis
+    stream. The stream's entry ids are assigned by redis, in order, as
+    entries are added, so they are used as the cursor rather than the clock
+    of the host which revoked the token.
+
+    Requires redis 5 or later.
+
+    :param redis: A ``redis.StrictRedis`` (or compatible) client.
+    :param key: (optional) The key of the set. The stream is stored at
+                ``key + ':log'``.
+    """
+
+    def __init__(self, redis, key='twopi:revoked-tokens'):
+        self.redis = redis
+        self.key = key
+        self.log_key = key + ':log'
+
+    def revoke(self, token_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.sadd(self.key, token_id)
+        pipe.xadd(self.log_key, {'token_id': token_id})
+        pipe.execute()
+
+    def is_revoked(self, token_id):
+        return bool(self.redis.sismember(self.key, token_id))
+
+    def revoked_since(self, cursor=None):
+        # XRANGE is inclusive, so start just after the cursor.
+        rows = self.redis.xrange(
+            self.log_key, '-' if cursor is None else _next_stream_id(cursor), '+')
+        if not rows:
+            return [], cursor
+
+        ids = [_text(fields.get(b'token_id', fields.get('token_id')))
+               for stream_id, fields in rows]
+        return ids, _text(rows[-1][0])
+
+
+class SQLRevocationBackend(RevocationBackend):
+    """
+    Stores revoked ids in a SQL table. Requires SQLAlchemy.
+
+    The table has an autoincrementing ``id`` primary key, a unique
+    ``token_id`` column and a ``revoked_at`` timestamp column. Create it
+    with ``backend.table.create(engine, checkfirst=True)``, or with your
+    migrations.
+
+    The ``id`` is used as the cursor. Ids are assigned when a row is
+    inserted, but a row only becomes visible when its transaction commits,
+    which may happen after a row with a later id has already been read. So
+    the rows revoked in the last ``overlap`` seconds are read again on
+    every refresh. ``overlap`` should cover the time an insert can take to
+    commit, plus any clock skew between hosts.
+
+    :param engine: The SQLAlchemy engine to use.
+    :param table_name: (optional) The name of the table.
+    :param metadata: (optional) The ``MetaData`` to define the table on.
+    :param overlap: (optional) Seconds of revocations to read again on
+                    every refresh. (Default: ``300``)
+    """
+
+    def __init__(self, engine, table_name='revoked_tokens', metadata=None,
+                 overlap=300):
+        from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+
+        self.engine = engine
+        self.overlap = overlap
+        self.table = Table(
+            table_name, metadata if metadata is not None else MetaData(),
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('token_id', String(255), nullable=False, unique=True),
+            Column('revoked_at', Float, nullable=False, index=True),
+        )
+
+    def revoke(self, token_id):
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert().values(
+                    token_id=token_id, revoked_at=time.time()))
+        except IntegrityError:
+            # Already revoked.
+            pass
+
+    def is_revoked(self, token_id):
+        query = _select(self.table.c.token_id).where(
+            self.table.c.token_id == token_id)
+        with self.engine.connect() as conn:
+            return conn.execute(query).first() is not None
+
+    def revoked_since(self, cursor=None):
+        from sqlalchemy import or_
+
+        query = _select(self.table.c.id, self.table.c.token_id) \
+            .order_by(self.table.c.id)
+        if cursor is not None:
+            query = query.where(or_(
+                self.table.c.id > cursor,
+                self.table.c.revoked_at >= time.time() - self.overlap))
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        if not rows:
+            return [], cursor
+        return [row[1] for row in rows], max(cursor or 0, rows[-1][0])
+
+
+def _select(*columns):
+    # SQLAlchemy < 1.4 takes a list of columns, 2.0 only takes them
+    # positionally.
+    import sqlalchemy
+
+    if tuple(int(part) for part in sqlalchemy.__version__.split('.')[:2]) < (1, 4):
+        return sqlalchemy.select(list(columns))
+    return sqlalchemy.select(*columns)
+
+
+class RevocationList(object):
+    """
+    Checks tokens against a :class:`RevocationBackend`, without a round trip
+    to the backend for the vast majority of tokens which aren't revoked.
+
+    Revoked ids are mirrored into a local Bloom filter, which is refreshed
+    incrementally from the backend at most every ``refresh_interval``
+    seconds. A token whose id isn't in the filter is definitely not revoked.
+    Only ids which hit the filter are checked against the backend, and
+    the ones that turn out not to be revoked are counted in
+    ``false_positives``.
+
+    .. code-block:: python
+
+        revocation = RevocationList(RedisRevocationBackend(redis),
+                                    key=attrgetter('refresh_token_id'))
+
+        @app.route('/protected')
+        @parse_auth_header(ShortlivedToken, revocation=revocation)
+        @auth_required()
+        def protected():
+            ...
+
+    Ids revoked by other processes are picked up at the next refresh, so a
+    revoked token may be accepted for up to ``refresh_interval`` seconds.
+    Ids revoked through :meth:`revoke` are rejected by this process
+    straight away.
+
+    :param backend: The :class:`RevocationBackend` holding revoked ids.
+    :param key: (optional) A callable returning the id to check for a
+                token. (Default: the token's ``token_id``, i.e. its ``jti``)
+    :param refresh_interval: (optional) Seconds between refreshes of the
+                             local filter. (Default: ``30``)
+    :param capacity: (optional) The number of revoked ids the filter is sized
+                     for. It is rebuilt larger if this is exceeded.
+    :param error_rate: (optional) The filter's false positive rate.
+    """
+
+    def __init__(self, backend, key=attrgetter('token_id'), refresh_interval=30,
+                 capacity=100000, error_rate=0.001):
+        self.backend = backend
+        self.key = key
+        self.refresh_interval = refresh_interval
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.checks = 0
+        self.backend_checks = 0
+        self.false_positives = 0
+
+        self._bloom = None
+        self._cursor = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Pull newly revoked ids from the backend into the local filter."""
+        with self._lock:
+            if self._bloom is None:
+                self._bloom = BloomFilter(self.capacity, self.error_rate)
+                self._cursor = None
+
+            ids, self._cursor = self.backend.revoked_since(self._cursor)
+            self._add_ids(ids)
+
+            if self._bloom.count > self._bloom.capacity:
+                # The filter is saturated. Rebuild it at twice the size from
+                # scratch.
+                self.capacity = self._bloom.count * 2
+                self._bloom = BloomFilter(self.capacity, self.error_rate)
+                ids, self._cursor = self.backend.revoked_since()
+                self._add_ids(ids)
+
+            self._refreshed_at = time.time()
+
+    def _add_ids(self, ids):
+        # Backends may return an id more than once. Adding it again wouldn't
+        # change the filter, but would count towards its capacity.
+        for token_id in ids:
+            if token_id not in self._bloom:
+                self._bloom.add(token_id)
+
+    def needs_refresh(self):
+        """
+        :returns: ``True`` if the local filter is due to be refreshed.
+        """
+        return self._refreshed_at is None or \
+            time.time() - self._refreshed_at >= self.refresh_interval
+
+    def revoke(self, token_id):
+        """
+        Revoke ``token_id`` in the backend and the local filter.
+        """
+        self.backend.revoke(token_id)
+        if self.needs_refresh():
+            self.refresh()
+        with self._lock:
+            self._add_ids([token_id])
+
+    def might_be_revoked(self, token_id):
+        """
+        Check ``token_id`` against the local filter only. The filter must
+        have been refreshed at least once.
+
+        :returns: ``False`` if ``token_id`` is definitely not revoked.
+        """
+        self.checks += 1
+        return token_id in self._bloom
+
+    def _record_backend_check(self, revoked):
+        self.backend_checks += 1
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    def is_revoked(self, token):
+        """
+        :param token: A loaded token.
+        :returns: ``True`` if ``token`` has been revoked.
+        """
+        token_id = self.key(token)
+        if token_id is None:
+            return False
+
+        if self.needs_refresh():
+            self.refresh()
+
+        if not self.might_be_revoked(token_id):
+            return False
+
+        return self._record_backend_check(self.backend.is_revoked(token_id))
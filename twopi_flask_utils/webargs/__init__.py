@@ -1,9 +1,221 @@
-from webargs.flaskparser import FlaskParser
-from webargs.core import ValidationError
-from flask import jsonify
+import threading
+from collections import deque
+from functools import wraps
+import marshmallow as ma
+from webargs.flaskparser import FlaskParser, abort
+from webargs.core import ValidationError, missing
+from werkzeug.exceptions import BadRequest
+from twopi_flask_utils._executors import LazyThreadPool
+from twopi_flask_utils.caching import LRUCache
+from twopi_flask_utils.restful import get_request_json, iter_json_items
+from twopi_flask_utils.restful.serializers import json_response
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
-class BetterFlaskParser(FlaskParser):
+try:
+    from webargs.core import dict2schema
+except ImportError:
+    # webargs >= 7 builds schemas with Schema.from_dict instead.
+    dict2schema = None
+
+try:
+    from webargs.core import MARSHMALLOW_VERSION_INFO
+except ImportError:
+    # Removed in webargs 8, which requires marshmallow 3.
+    MARSHMALLOW_VERSION_INFO = (3,)
+
+try:
+    # webargs < 6 parses each field from its locations one at a time, which
+    # CachingFlaskParser plans once per schema.
+    from webargs.core import get_value
+except ImportError:
+    get_value = None
+
+#: Methods whose requests are never parsed for a body.
+BODYLESS_METHODS = frozenset(['GET', 'HEAD'])
+
+#: The number of threads used to validate bulk payloads, when enabled.
+BULK_WORKERS = 4
+
+_bulk_pool = LazyThreadPool()
+
+
+def _bulk_executor():
+    return _bulk_pool.get(BULK_WORKERS)
+
+
+class CachingFlaskParser(FlaskParser):
+    """
+    A ``FlaskParser`` which builds the schema for a ``dict`` argmap once,
+    rather than on every parse. Schemas are memoized per argmap (by
+    identity), with an instance per thread, since marshmallow schemas hold
+    state while loading. ``use_args`` and ``use_kwargs`` build the schema
+    when the view is decorated.
+
+    With webargs < 6, the locations each field is read from are also worked
+    out once per schema, so parsing only reads the locations the argmap
+    declares (e.g. an argmap of ``location='query'`` fields never touches
+    the body). The body (``json``, ``form`` and ``files``) is never read for
+    ``GET`` and ``HEAD`` requests, and JSON is decoded with
+    :func:`~twopi_flask_utils.restful.get_request_json`, so it is decoded at
+    most once per request. A body which isn't valid JSON is rejected with a
+    ``400`` by :meth:`handle_invalid_json_error`.
+
+    :param schema_cache_size: (optional) The number of argmaps to remember
+                              schemas for. (Default: ``256``)
+
+    Any other keyword arguments (e.g. ``schema_class``) are passed to
+    ``FlaskParser``.
+    """
+
+    def __init__(self, locations=None, error_handler=None, schema_cache_size=256,
+                 **kwargs):
+        super(CachingFlaskParser, self).__init__(
+            locations, error_handler=error_handler, **kwargs)
+        self._schemas = LRUCache(maxsize=schema_cache_size)
+        self._locations = {}
+        self._plans = LRUCache(maxsize=schema_cache_size)
+
+    def _cached_schema(self, argmap):
+        # Keyed on id(), so the argmap is kept alongside to check the id
+        # hasn't been reused by another dict. Also accepts a Schema class.
+        cached = self._schemas.get(id(argmap))
+        if cached is None or cached[0] is not argmap:
+            schema_cls = self._dict2schema(argmap) if isinstance(argmap, Mapping) \
+                else argmap
+            cached = (argmap, schema_cls, threading.local())
+            self._schemas.set(id(argmap), cached)
+
+        argmap, schema_cls, local = cached
+        schema = getattr(local, 'schema', None)
+        if schema is None:
+            schema = local.schema = schema_cls()
+        return schema
+
+    def _dict2schema(self, argmap):
+        # Build the schema class as webargs would. webargs < 5 has no
+        # schema_class.
+        schema_class = getattr(self, 'schema_class', None)
+        if schema_class is None:
+            return dict2schema(argmap)
+        if dict2schema is None:
+            return schema_class.from_dict(argmap)
+        return dict2schema(argmap, schema_class=schema_class)
+
+    def _get_schema(self, argmap, req):
+        if isinstance(argmap, Mapping):
+            return self._cached_schema(argmap)
+        return super(CachingFlaskParser, self)._get_schema(argmap, req)
+
+    def _validated_locations(self, locations):
+        # Checked for every field of every parse, so remember each set of
+        # locations once it has been validated.
+        key = tuple(locations)
+        validated = self._locations.get(key)
+        if validated is None:
+            validated = self._locations[key] = tuple(
+                super(CachingFlaskParser, self)._validated_locations(locations))
+        return validated
+
+    def _parse_plan(self, schema, locations):
+        # A tuple of (names, field, locations) for each field of the schema.
+        locations = tuple(locations or self.locations)
+        # Instances of a schema class may have different fields, e.g. with
+        # only or exclude.
+        key = (type(schema), tuple(schema.fields), locations)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = []
+            for argname, field_obj in schema.fields.items():
+                if MARSHMALLOW_VERSION_INFO[0] < 3:
+                    names = (argname, field_obj.load_from) if field_obj.load_from \
+                        else (argname,)
+                else:
+                    names = (field_obj.data_key or argname,)
+
+                location = field_obj.metadata.get('location')
+                plan.append((names, field_obj, self._validated_locations(
+                    [location] if location else locations)))
+
+            plan = tuple(plan)
+            self._plans.set(key, plan)
+        return plan
+
+    def _parse_request(self, schema, req, locations):
+        if schema.many:
+            return super(CachingFlaskParser, self)._parse_request(schema, req, locations)
+
+        parsed = {}
+        for names, field_obj, field_locations in self._parse_plan(schema, locations):
+            for name in names:
+                value = self._first_value(name, field_obj, req, field_locations)
+                if value is not missing:
+                    parsed[name] = value
+                    break
+        return parsed
+
+    def _first_value(self, name, field_obj, req, locations):
+        for location in locations:
+            value = self._get_value(name, field_obj, req, location)
+            if value is not missing:
+                return value
+        return missing
+
+    def _has_body(self, req):
+        return req.method not in BODYLESS_METHODS
+
+    def parse_json(self, req, name, field):
+        if not self._has_body(req):
+            return missing
+
+        try:
+            json_data = get_request_json()
+        except BadRequest as error:
+            if not req.get_data(cache=True):
+                # An empty body is missing, rather than invalid.
+                return missing
+            return self.handle_invalid_json_error(error, req)
+
+        if json_data is None:
+            return missing
+        return get_value(json_data, name, field, allow_many_nested=True)
+
+    def handle_invalid_json_error(self, error, req, *args, **kwargs):
+        """
+        Abort with a ``400`` when the body isn't valid JSON, as webargs >= 5
+        does.
+        """
+        abort(400, exc=error, messages={'json': ['Invalid JSON body.']})
+
+    def parse_form(self, req, name, field):
+        if not self._has_body(req):
+            return missing
+        return super(CachingFlaskParser, self).parse_form(req, name, field)
+
+    def parse_files(self, req, name, field):
+        if not self._has_body(req):
+            return missing
+        return super(CachingFlaskParser, self).parse_files(req, name, field)
+
+    def use_args(self, argmap, *args, **kwargs):
+        if isinstance(argmap, Mapping):
+            # Build the schema (and work out its locations) now, and have
+            # webargs fetch this thread's instance of it on each request.
+            schema = self._cached_schema(argmap)
+            if get_value is not None:
+                self._parse_plan(schema, kwargs.get('locations'))
+            dict_argmap = argmap
+
+            def argmap(req):
+                return self._cached_schema(dict_argmap)
+
+        return super(CachingFlaskParser, self).use_args(argmap, *args, **kwargs)
+
+
+class BetterFlaskParser(CachingFlaskParser):
     """
     A Flask-Restful compatible parser for WebArgs.
     """
@@ -18,10 +230,227 @@ class BetterFlaskParser(FlaskParser):
         """
         raise error
 
+    def _load_chunk(self, argmap, chunk):
+        if isinstance(argmap, ma.Schema):
+            schema = argmap
+        else:
+            schema = self._cached_schema(argmap)
+
+        try:
+            result = schema.load(chunk, many=True)
+        except ma.ValidationError as exc:
+            return None, exc.messages
+
+        if MARSHMALLOW_VERSION_INFO[0] < 3:
+            return result.data, result.errors
+        return result, {}
+
+    def parse_bulk(self, argmap, prefix='item', chunk_size=500, max_errors=None,
+                   threaded=False, executor=None, max_size=None):
+        """
+        Validate an array of objects in the JSON body against ``argmap``,
+        for bulk endpoints.
+
+        Elements are read from the body as they are parsed (see
+        :func:`~twopi_flask_utils.restful.iter_json_items`) and validated
+        ``chunk_size`` at a time. If any are invalid, a
+        :class:`BulkValidationError` reporting the errors of each invalid
+        element by its index is raised once every element has been
+        validated, or as soon as ``max_errors`` elements are invalid.
+
+        :param argmap: A ``dict`` of fields, a ``Schema`` class, or a
+                       ``Schema`` instance (which must not be shared between
+                       threads if ``threaded`` is used).
+        :param prefix: (optional) The ``ijson`` prefix of the elements.
+                       (Default: ``item``, a top level array)
+        :param chunk_size: (optional) The number of elements to validate at
+                           a time. (Default: ``500``)
+        :param max_errors: (optional) Stop validating after this many
+                           invalid elements. (Default: ``None``, validate
+                           everything)
+        :param threaded: (optional, ``bool``) Validate chunks in a thread
+                         pool, for schemas with expensive custom validators.
+                         (Default: ``False``)
+        :param executor: (optional) The ``concurrent.futures`` executor to
+                         use when ``threaded``. (Default: a shared pool)
+        :param max_size: (optional) The largest body, in bytes, to accept.
+        :returns: A list of the loaded elements.
+        :raises ExpectedJSONException: If the body isn't JSON, or the
+                                       elements aren't in an array.
+        """
+        if isinstance(argmap, Mapping):
+            self._cached_schema(argmap)
+
+        if threaded and executor is None:
+            executor = _bulk_executor()
+        elif not threaded:
+            executor = None
+
+        loaded = []
+        errors = {}
+        error_count = 0
+        truncated = False
+        pending = deque()
+
+        def collect(offset, result):
+            data, chunk_errors = result
+            count = 0
+            for index, item_errors in sorted(chunk_errors.items(), key=_index_order):
+                item_errors = _flatten_errors(item_errors)
+                if item_errors:
+                    errors[_offset_index(index, offset)] = item_errors
+                    count += 1
+
+            if not count and not errors:
+                loaded.extend(data)
+            return count
+
+        def over_limit():
+            return max_errors is not None and error_count >= max_errors
+
+        items = iter_json_items(prefix, max_size)
+        for offset, chunk in _chunks(items, chunk_size):
+            if executor is None:
+                error_count += collect(offset, self._load_chunk(argmap, chunk))
+            else:
+                pending.append((offset, executor.submit(self._load_chunk, argmap, chunk)))
+                if len(pending) > BULK_WORKERS * 2:
+                    offset, future = pending.popleft()
+                    error_count += collect(offset, future.result())
+
+            if over_limit():
+                # Only truncated if some elements are left unvalidated.
+                truncated = bool(pending) or next(items, _end) is not _end
+                break
+
+        while pending:
+            offset, future = pending.popleft()
+            if truncated:
+                future.cancel()
+                continue
+
+            error_count += collect(offset, future.result())
+            truncated = over_limit() and bool(pending)
+
+        if error_count:
+            if max_errors is not None and len(errors) > max_errors:
+                # Report the first max_errors, in order.
+                errors = dict(sorted(errors.items(), key=_index_order)[:max_errors])
+            raise BulkValidationError(errors, error_count, truncated)
+
+        return loaded
+
+    def use_bulk_args(self, argmap, **kwargs):
+        """
+        A decorator which validates the request body with :meth:`parse_bulk`
+        and passes the list of loaded elements as the view's last positional
+        argument. ``kwargs`` are passed to :meth:`parse_bulk`.
+
+        .. code-block:: python
+
+            @app.route('/items/bulk', methods=['POST'])
+            @use_bulk_args(ItemSchema, max_errors=100)
+            def create_items(items):
+                ...
+        """
+        if isinstance(argmap, Mapping):
+            self._cached_schema(argmap)
+
+        def decorator(f):
+            @wraps(f)
+            def wrapped(*args, **view_kwargs):
+                items = self.parse_bulk(argmap, **kwargs)
+                return f(*(args + (items,)), **view_kwargs)
+            return wrapped
+        return decorator
+
+
+class BulkValidationError(ValidationError):
+    """
+    Raised by :meth:`BetterFlaskParser.parse_bulk` when elements are
+    invalid. ``messages`` is a dict of the index of each invalid element to
+    its errors, keyed by field (with nested fields joined by ``.``).
+
+    :param error_count: The number of invalid elements found.
+    :param truncated: ``True`` if validation stopped early, after
+                      ``max_errors`` invalid elements.
+    """
+
+    status_code = 422
+
+    def __init__(self, messages, error_count, truncated=False):
+        super(BulkValidationError, self).__init__(messages)
+        self.error_count = error_count
+        self.truncated = truncated
+
+    def report(self):
+        """
+        :returns: The body of the error response.
+        """
+        if self.truncated:
+            summary = "Validation stopped after {} invalid items.".format(
+                self.error_count)
+        else:
+            summary = "{} of the items provided were invalid.".format(self.error_count)
+
+        return {
+            '_errors': [summary],
+            'items': self.messages,
+            'truncated': self.truncated,
+        }
+
+
+_end = object()
+
+
+def _chunks(items, size):
+    # Yield (offset, chunk) tuples of up to size items.
+    chunk = []
+    offset = 0
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield offset, chunk
+            offset += size
+            chunk = []
+    if chunk:
+        yield offset, chunk
+
+
+def _offset_index(index, offset):
+    try:
+        return str(int(index) + offset)
+    except (TypeError, ValueError):
+        # Not an element's errors, e.g. "_schema" for a non-list payload.
+        return str(index)
+
+
+def _index_order(item):
+    key = item[0]
+    try:
+        return (0, int(key), '')
+    except (TypeError, ValueError):
+        return (1, 0, str(key))
+
+
+def _flatten_errors(errors, prefix=''):
+    if not isinstance(errors, dict):
+        return {prefix or '_schema': errors}
+
+    flat = {}
+    for key, value in errors.items():
+        name = '{}.{}'.format(prefix, key) if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten_errors(value, name))
+        else:
+            flat[name] = value
+    return flat
+
 
 parser = BetterFlaskParser()
 use_args = parser.use_args
 use_kwargs = parser.use_kwargs
+use_bulk_args = parser.use_bulk_args
 
 def handle_validation_error(exc):
     """
@@ -37,8 +466,8 @@ def handle_validation_error(exc):
         app.errorhandler(ValidationError)(handle_validation_error)
 
 
-    This function will produce a jsonified response with the field errors from
-    the ValidationError.
+    This function will produce a JSON response with the field errors from
+    the ValidationError, or the report of a :class:`BulkValidationError`.
 
     .. warning::
 
@@ -48,10 +477,13 @@ def handle_validation_error(exc):
 
     """
 
-    assert(type(exc) == ValidationError)
-    return jsonify(exc.messages), exc.status_code
+    assert isinstance(exc, ValidationError)
+    status_code = getattr(exc, 'status_code', 422)
+    if isinstance(exc, BulkValidationError):
+        return json_response(exc.report(), status_code)
+    return json_response(exc.messages, status_code)
 
 
-__all__ = ['BetterFlaskParser', 'parser', 'use_args', 'use_kwargs',
-           'handle_validation_error']
+__all__ = ['CachingFlaskParser', 'BetterFlaskParser', 'BulkValidationError', 'parser',
+           'use_args', 'use_kwargs', 'use_bulk_args', 'handle_validation_error']
 